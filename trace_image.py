@@ -1,186 +1,2967 @@
+import io
 import os
-import cv2
+import sys
+import time
+import queue
+import threading
 import numpy as np
-from PIL import Image
 from xml.etree.ElementTree import Element, SubElement, ElementTree
-import tempfile
-from svglib.svglib import svg2rlg
-from reportlab.graphics import renderPDF
-import fitz  # Thêm thư viện PyMuPDF
+import hashlib
+import json
+import shutil
+import mmap
+import cProfile
+import contextlib
+import argparse
+import socket
+import bisect
+import collections
+from dataclasses import dataclass, fields, replace
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from utils.image_header import read_image_header, read_image_header_file
+from utils.simplify import filter_contours, simplify_contours
 
-def create_svg_path_from_contours(contours):
+# Kích thước trang PDF đầu ra (points)
+TARGET_SIZE = 144
+
+# Tham số tracing (mọi giá trị ảnh hưởng tới kết quả đều phải nằm trong trace_params)
+BLUR_KERNEL = (5, 5)
+BLUR_SIGMA = 0.5
+THRESHOLD = 127
+EPSILON_FACTOR = 0.0005
+MIN_CONTOUR_AREA = 10
+
+# Tăng khi thay đổi thuật toán để các kết quả cũ trong cache không còn khớp
+CACHE_VERSION = 1
+# Giới hạn dung lượng cache mặc định (bytes)
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Backend ghi PDF: "native" ghi contours trực tiếp vào content stream,
+# "svg" đi qua SVG -> svglib -> reportlab -> PyMuPDF như trước (để so sánh)
+BACKENDS = ('native', 'svg')
+
+# Các định dạng ảnh được hỗ trợ
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Độ phân giải khi trace: 'source' = ảnh gốc, 'output' = thu nhỏ bằng image
+# pyramid (pyrDown) tới khi mỗi pixel gần bằng một pixel đầu ra ở OUTPUT_DPI
+RESOLUTIONS = ('source', 'output')
+OUTPUT_DPI = 288
+# Sai số khi đơn giản hóa contour ở chế độ 'output', tính theo point trên trang 144x144
+# (nửa pixel đầu ra ở OUTPUT_DPI)
+TOLERANCE_PT = 0.125
+# Tỷ lệ pixel sai lệch tối đa (ngoài dải 1 pixel quanh biên) giữa contour ở độ
+# phân giải thấp và ảnh nhị phân gốc, vượt quá thì trace lại ở độ phân giải gốc
+MAX_TRACE_ERROR = 0.01
+
+# Cách đơn giản hóa contour: 'opencv' = approxPolyDP từng contour với
+# EPSILON_FACTOR * chu vi (mặc định); 'dp'/'vw' = Douglas–Peucker hoặc
+# Visvalingam–Whyatt trên cả tập contour với sai số chung TOLERANCE_PT
+SIMPLIFY_METHODS = ('opencv', 'dp', 'vw')
+# Với 'dp'/'vw', bỏ các hình có bounding box nhỏ hơn kích thước này (points)
+MIN_FEATURE_PT = 0.25
+
+# Các tùy chọn tối ưu PDF đầu ra:
+#   quantize: tọa độ theo lưới QUANTIZE_STEP points trên trang 144x144 (backend native)
+#   compress: nén (deflate) mọi stream khi lưu
+#   flatten:  backend svg resize bằng một phép cm thay vì Form XObject lồng nhau
+#   dedupe:   các hình giống hệt nhau (kể cả giữa các trang) dùng chung một Form XObject (backend native)
+OPTIMIZATIONS = ('quantize', 'compress', 'flatten', 'dedupe')
+# Lưới 999 bước trên trang TARGET_SIZE (~0.144 point, dưới một điểm ảnh ở 500 DPI):
+# tọa độ sau khi quantize có tối đa 3 chữ số, ngắn hơn tọa độ pixel của ảnh từ
+# 1000 pixel trở lên; ảnh nhỏ hơn giữ nguyên tọa độ pixel (xem quantize_polygons)
+QUANTIZE_STEP = TARGET_SIZE / 999
+# Hình phải có ít nhất chừng này điểm mới đáng tách thành XObject dùng chung
+DEDUPE_MIN_POINTS = 8
+
+# Chế độ nhiều lớp (levels): số mức xám/màu tối đa, và số pixel lấy mẫu để
+# tìm bảng màu bằng k-means (palette)
+MAX_LEVELS = 16
+PALETTE_SAMPLE = 100000
+# Màu nền (0..1) sáng hơn mức này ở mọi kênh được coi là trắng và không cần tô
+WHITE_BACKGROUND = 0.98
+
+# Lập lịch theo ngân sách bộ nhớ (memory_budget): RSS của một process worker
+# chưa xử lý ảnh (Python, OpenCV, PyMuPDF), và phần dành cho contours, polygon
+# và content stream (bytes mỗi pixel). Ảnh rất vụn (hàng trăm nghìn hình nhỏ)
+# có thể vượt mức này
+WORKER_BASE_BYTES = 100 * 1024 * 1024
+CONTOUR_BYTES_PER_PIXEL = 2
+
+# Ngân sách vẽ của một trang (render_budget), kiểm tra ngay sau khi tìm
+# contours: số contour, số điểm và số bytes của các toán tử path (render_cost,
+# theo số chữ số của tọa độ: ~10 bytes/điểm với ảnh dưới 1000 pixel, 11-12 với
+# ảnh scan lớn hơn, ~17 với tọa độ thập phân của resolution='output'). Giới hạn
+# bytes mặc định ứng với ~10.5 bytes/điểm: ảnh nhỏ chạm giới hạn số điểm trước,
+# ảnh lớn và tọa độ thập phân chạm giới hạn bytes trước.
+# Vượt một giới hạn thì áp dụng một chính sách:
+#   simplify: đơn giản hóa mạnh dần (sai số gấp đôi từ TOLERANCE_PT tới
+#             MAX_BUDGET_TOLERANCE_PT), vẫn vượt thì chuyển sang raster
+#   raster:   nhúng ảnh 1-bit nén ở OUTPUT_DPI thay cho vector
+RENDER_BUDGET = {'contours': 20000, 'vertices': 500000, 'bytes': 5 * 1024 * 1024}
+BUDGET_POLICIES = ('simplify', 'raster')
+MAX_BUDGET_TOLERANCE_PT = 1.0
+
+# Metrics của ảnh đang xử lý trong thread hiện tại (None nếu không ghi)
+_metrics = threading.local()
+
+@contextlib.contextmanager
+def collect_metrics(image_file):
+    """
+    Ghi wall/CPU time của từng bước và số contour/điểm cho một ảnh
+    
+    Yields:
+        dict: {'file', 'wall_ms', 'cpu_ms', 'stages': {tên bước: {'wall_ms', 'cpu_ms'}},
+            'counts': {...}}, được điền đầy đủ khi thoát khỏi khối with
+    """
+    record = {'file': image_file, 'wall_ms': 0.0, 'cpu_ms': 0.0, 'stages': {}, 'counts': {}}
+    previous = getattr(_metrics, 'record', None)
+    _metrics.record = record
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_ms'] = (time.perf_counter() - wall) * 1000
+        record['cpu_ms'] = (time.process_time() - cpu) * 1000
+        _metrics.record = previous
+
+def _error_metrics(image_file, wall_ms=0.0):
+    """Bản ghi metrics tối thiểu cho ảnh lỗi trước khi vào worker (đọc file lỗi, worker chết)"""
+    return {'file': image_file, 'wall_ms': wall_ms, 'cpu_ms': 0.0, 'stages': {}, 'counts': {}, 'status': 'error'}
+
+@contextlib.contextmanager
+def _stage(name):
+    """Cộng thời gian của khối lệnh vào bước `name` (không làm gì nếu không ghi metrics)"""
+    record = getattr(_metrics, 'record', None)
+    if record is None:
+        yield
+        return
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        entry = record['stages'].setdefault(name, {'wall_ms': 0.0, 'cpu_ms': 0.0})
+        entry['wall_ms'] += (time.perf_counter() - wall) * 1000
+        entry['cpu_ms'] += (time.process_time() - cpu) * 1000
+
+@contextlib.contextmanager
+def _stage_alone(name):
+    """Như _stage nhưng các bước lồng bên trong chỉ được cộng vào `name`, không vào bước riêng của chúng"""
+    with _stage(name):
+        record = getattr(_metrics, 'record', None)
+        _metrics.record = None
+        try:
+            yield
+        finally:
+            _metrics.record = record
+
+def _count(name, value):
+    """Ghi một số đếm (contours, điểm...) cho ảnh đang xử lý"""
+    record = getattr(_metrics, 'record', None)
+    if record is not None:
+        record['counts'][name] = value
+
+class JsonLinesSink:
+    """Ghi mỗi bản ghi metrics thành một dòng JSON"""
+    
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+    
+    def __call__(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+
+def make_metrics_sink(target):
+    """Đường dẫn file -> JsonLinesSink; hàm nhận một dict -> dùng trực tiếp"""
+    if target is None or callable(target):
+        return target
+    return JsonLinesSink(target)
+
+def approximate_contours(contours, epsilon=None):
+    """
+    Đơn giản hóa từng contour bằng approxPolyDP, trả về danh sách mảng điểm (N, 2).
+    epsilon (pixel) cố định cho mọi contour, mặc định EPSILON_FACTOR * chu vi;
+    epsilon = 0: contour đã được đơn giản hóa (simplify_contours), giữ nguyên
+    """
+    import cv2
+    if epsilon == 0:
+        approximated = [contour.reshape(-1, 2) for contour in contours]
+        _count('vertices', sum(len(points) for points in approximated))
+        return approximated
+    
+    approximated = []
+    with _stage('approx'):
+        for contour in contours:
+            tolerance = EPSILON_FACTOR * cv2.arcLength(contour, True) if epsilon is None else epsilon
+            approx = cv2.approxPolyDP(contour, tolerance, True)
+            approximated.append(approx.reshape(-1, 2))
+    _count('vertices', sum(len(points) for points in approximated))
+    return approximated
+
+def _path_template(counts, move, line, close):
+    """Khuôn chuỗi cho cả tập polygon: lặp theo contour, không lặp theo điểm"""
+    return "".join(move + line * (count - 1) + close for count in counts)
+
+def format_path_data(polygons, precision=2, relative=False):
+    """
+    Tạo SVG path data cho tất cả polygon trong một lần format
+    
+    Args:
+        polygons (list): Danh sách mảng điểm (N, 2)
+        precision (int): Số chữ số thập phân (0 = tọa độ nguyên)
+        relative (bool): Ghi độ dời m/l/z thay vì tọa độ tuyệt đối M/L/Z
+    
+    Returns:
+        str: Path data; precision=2, relative=False cho kết quả giống hệt
+            định dạng cũ "M x.xx,y.yy L x.xx,y.yy ... Z "
+    """
+    polygons = [points for points in polygons if len(points) > 0]
+    if not polygons:
+        return ""
+    
+    counts = [len(points) for points in polygons]
+    points = np.concatenate(polygons).reshape(-1, 2)
+    coord = f"%.{precision}f,%.{precision}f "
+    
+    if relative:
+        # Làm tròn trước khi lấy hiệu để sai số không bị cộng dồn
+        points = np.round(points.astype(np.float64), precision)
+        previous = np.zeros_like(points)
+        previous[1:] = points[:-1]
+        # Sau "z" điểm hiện tại quay về điểm đầu của polygon trước đó
+        starts = np.cumsum([0] + counts[:-1])
+        previous[starts[1:]] = points[starts[:-1]]
+        previous[0] = 0
+        points = np.round(points - previous, precision) + 0.0  # + 0.0 để bỏ "-0"
+        template = _path_template(counts, "m " + coord, "l " + coord, "z ")
+    else:
+        template = _path_template(counts, "M " + coord, "L " + coord, "Z ")
+    
+    return template % tuple(points.ravel().tolist())
+
+def create_svg_path_from_contours(contours, precision=2, relative=False, epsilon=None):
     """Tạo SVG path data từ contours"""
-    path_data = ""
-    for contour in contours:
-        epsilon = 0.0005 * cv2.arcLength(contour, True)
-        approx = cv2.approxPolyDP(contour, epsilon, True)
+    polygons = approximate_contours(contours, epsilon)
+    with _stage('serialize'):
+        return format_path_data(polygons, precision, relative)
+
+def format_pdf_path(polygons):
+    """Các toán tử path của PDF (m/l/h) cho tất cả polygon trong một lần format"""
+    polygons = [points for points in polygons if len(points) > 0]
+    if not polygons:
+        return ""
+    
+    with _stage('serialize'):
+        points = np.concatenate(polygons)
+        coord = "%d %d" if np.issubdtype(points.dtype, np.integer) else "%.2f %.2f"
+        template = _path_template([len(p) for p in polygons], coord + " m\n", coord + " l\n", "h\n")
+        return (template % tuple(points.ravel().tolist()))[:-1]
+
+def _format_number(value):
+    """Số gọn cho PDF: bỏ số 0 thừa ở phần thập phân"""
+    text = f"{value:.6f}".rstrip('0').rstrip('.')
+    return text if text not in ('', '-0') else '0'
+
+def page_transform(width, height, width_pt, height_pt, target_size=TARGET_SIZE):
+    """
+    Ma trận (a, b, c, d, e, f) đưa tọa độ pixel (gốc trên-trái) về trang
+    target_size x target_size: scale theo DPI, thu nhỏ giữ tỷ lệ và căn giữa
+    giống show_pdf_page trong resize_pdf
+    """
+    scale = target_size / max(width_pt, height_pt)
+    sx = width_pt / width * scale
+    sy = height_pt / height * scale
+    offset_x = (target_size - width_pt * scale) / 2
+    offset_y = (target_size - height_pt * scale) / 2
+    # Trục y của PDF hướng lên nên lật ảnh theo chiều dọc
+    return (sx, 0, 0, -sy, offset_x, offset_y + height * sy)
+
+def resolve_render_budget(budget):
+    """None/False: không giới hạn, True: RENDER_BUDGET, hoặc dict ghi đè một số giới hạn của RENDER_BUDGET"""
+    if not budget:
+        return None
+    if budget is True:
+        return dict(RENDER_BUDGET)
+    unknown = set(budget) - set(RENDER_BUDGET)
+    if unknown:
+        raise ValueError(f"Giới hạn không hợp lệ: {sorted(unknown)} (chọn trong {tuple(RENDER_BUDGET)})")
+    return dict(RENDER_BUDGET, **budget)
+
+def resolve_optimizations(optimize):
+    """None/False: không tối ưu, True: tất cả, hoặc danh sách tên trong OPTIMIZATIONS"""
+    if not optimize:
+        return frozenset()
+    if optimize is True:
+        return frozenset(OPTIMIZATIONS)
+    unknown = set(optimize) - set(OPTIMIZATIONS)
+    if unknown:
+        raise ValueError(f"Tùy chọn tối ưu không hợp lệ: {sorted(unknown)} (chọn trong {OPTIMIZATIONS})")
+    return frozenset(optimize)
+
+def page_geometry(contours, width, height, width_pt, height_pt, quantize_step=None, epsilon=None):
+    """
+    Polygon (sau approxPolyDP) và ma trận cm của trang 144x144
+    
+    Với quantize_step, tọa độ được đưa sang lưới quantize_step points trên
+    trang; các điểm trùng liên tiếp và polygon suy biến (< 3 điểm) bị bỏ.
+    Khi một pixel đã lớn hơn bước lưới thì giữ tọa độ pixel (số ngắn hơn)
+    
+    Returns:
+        tuple: (danh sách mảng điểm nguyên (N, 2), ma trận (a, b, c, d, e, f))
+    """
+    polygons = [points for points in approximate_contours(contours, epsilon) if len(points) > 0]
+    matrix = page_transform(width, height, width_pt, height_pt)
+    if quantize_step is None:
+        return polygons, matrix
+    return quantize_polygons(polygons, matrix, quantize_step)
+
+def quantize_polygons(polygons, matrix, quantize_step):
+    """
+    Đưa polygon của page_geometry sang lưới quantize_step points trên trang.
+    Trả lại đúng (polygons, matrix) đã nhận khi một pixel đã lớn hơn bước lưới
+    
+    Returns:
+        tuple: (danh sách mảng điểm nguyên (N, 2), ma trận (a, b, c, d, e, f))
+    """
+    a, _, _, d, e, f = matrix
+    if min(a, -d) >= quantize_step:
+        return polygons, matrix
+    if not polygons:
+        return polygons, (quantize_step, 0, 0, quantize_step, 0, 0)
+    
+    with _stage('quantize'):
+        counts = np.array([len(points) for points in polygons])
+        points = np.concatenate(polygons).astype(np.float64)
+        # Làm tròn điểm đầu và độ dời so với điểm đầu riêng rẽ để các hình
+        # giống nhau vẫn giống nhau sau khi làm tròn (cho 'dedupe')
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        scale = np.array([a, d]) / quantize_step
+        origin = np.rint((points[first] * [a, d] + [e, f]) / quantize_step)
+        grid = (origin + np.rint((points - points[first]) * scale)).astype(np.int64)
+        
+        # Bỏ điểm trùng với điểm liền trước trong cùng polygon
+        keep = np.ones(len(grid), bool)
+        keep[1:] = np.any(grid[1:] != grid[:-1], axis=1)
+        keep[np.cumsum(counts)[:-1]] = True
+        owner = np.repeat(np.arange(len(polygons)), counts)[keep]
+        kept_counts = np.bincount(owner, minlength=len(polygons))
+        parts = np.split(grid[keep], np.cumsum(kept_counts)[:-1])
+        polygons = [points for points in parts if len(points) >= 3]
+    
+    return polygons, (quantize_step, 0, 0, quantize_step, 0, 0)
+
+class ShapeTable:
+    """
+    Form XObject dùng chung cho các hình lặp lại trong một tài liệu. Hình
+    được tách ra khi đã xuất hiện ở trang trước hoặc lặp lại trong cùng trang
+    """
+    
+    def __init__(self, doc):
+        self.doc = doc
+        self.xobjects = {}  # khóa hình -> (tên, xref)
+        self.seen = set()
+    
+    def _create(self, key, local):
+        x0, y0 = local.min(axis=0) - 1
+        x1, y1 = local.max(axis=0) + 1
+        xref = self.doc.get_new_xref()
+        self.doc.update_object(xref, f"<< /Type /XObject /Subtype /Form /BBox [{x0} {y0} {x1} {y1}] >>")
+        self.doc.update_stream(xref, (format_pdf_path([local]) + "\nf*\n").encode('ascii'))
+        self.xobjects[key] = (f"S{len(self.xobjects) + 1}", xref)
+    
+    def assign(self, polygons):
+        """Tên XObject cho từng polygon của một trang (None = vẽ trực tiếp)"""
+        keys = []
+        for points in polygons:
+            if len(points) < DEDUPE_MIN_POINTS:
+                keys.append(None)
+                continue
+            local = points - points[0]
+            keys.append((local.dtype.str.encode() + local.tobytes(), local))
+        
+        page_counts = {}
+        for key in keys:
+            if key is not None:
+                page_counts[key[0]] = page_counts.get(key[0], 0) + 1
         
-        points = approx.reshape(-1, 2)
-        if len(points) > 0:
-            path_data += f"M {points[0][0]:.2f},{points[0][1]:.2f} "
-            for i in range(1, len(points)):
-                path_data += f"L {points[i][0]:.2f},{points[i][1]:.2f} "
-            path_data += "Z "
+        names = []
+        for key in keys:
+            if key is None:
+                names.append(None)
+                continue
+            shape, local = key
+            if shape not in self.xobjects and (shape in self.seen or page_counts[shape] > 1):
+                self._create(shape, local)
+            names.append(self.xobjects[shape][0] if shape in self.xobjects else None)
+            self.seen.add(shape)
+        return names
+    
+    def resources(self, names):
+        """Dictionary /Resources cho các XObject mà trang dùng"""
+        used = {name for name in names if name}
+        entries = " ".join(f"/{name} {xref} 0 R" for name, xref in self.xobjects.values() if name in used)
+        return f"<< /XObject << {entries} >> >>"
+
+def _page_content(polygons, matrix, shapes=None, color=(0, 0, 0)):
+    """Content stream: một phép cm, các path vẽ trực tiếp tô even-odd, rồi các XObject dùng chung"""
+    matrix_text = " ".join(_format_number(v) for v in matrix)
+    inline = polygons if shapes is None else [p for p, name in zip(polygons, shapes) if name is None]
+    path_ops = format_pdf_path(inline)
+    
+    color_text = " ".join(_format_number(v) for v in color)
+    content = f"q\n{color_text} rg\n" + matrix_text + " cm\n"
+    if path_ops:
+        content += path_ops + "\nf*\n"
+    if shapes is not None:
+        with _stage('serialize'):
+            content += "".join(
+                f"q 1 0 0 1 {points[0][0]} {points[0][1]} cm /{name} Do Q\n"
+                for points, name in zip(polygons, shapes) if name
+            )
+    content += "Q\n"
+    return content.encode('ascii')
+
+def add_content_page(doc, content, resources=None):
+    """Thêm một trang 144x144 với content stream (và /Resources) cho sẵn vào doc"""
+    with _stage('render'):
+        page = doc.new_page(width=TARGET_SIZE, height=TARGET_SIZE)
+        xref = doc.get_new_xref()
+        doc.update_object(xref, "<<>>")
+        doc.update_stream(xref, content)
+        doc.xref_set_key(page.xref, "Contents", f"{xref} 0 R")
+        if resources:
+            doc.xref_set_key(page.xref, "Resources", resources)
+
+def add_polygon_page(doc, polygons, matrix, shape_table=None):
+    """Thêm trang từ polygon đã tính sẵn; với shape_table, hình lặp lại dùng XObject chung"""
+    shapes = shape_table.assign(polygons) if shape_table is not None else None
+    resources = shape_table.resources(shapes) if shapes and any(shapes) else None
+    add_content_page(doc, _page_content(polygons, matrix, shapes), resources)
+
+def layered_geometry(layers, width, height, width_pt, height_pt, quantize_step=None, epsilon=None):
+    """
+    page_geometry cho từng lớp của trace_layers
+    
+    Returns:
+        tuple: ([(màu, polygon của lớp)], ma trận chung)
+    """
+    geometry = [(color, page_geometry(contours, width, height, width_pt, height_pt, epsilon=epsilon)[0])
+                for color, contours in layers]
+    matrix = page_transform(width, height, width_pt, height_pt)
+    if quantize_step is None:
+        return geometry, matrix
+    return quantize_layers(geometry, matrix, quantize_step)
+
+def quantize_layers(geometry, matrix, quantize_step):
+    """quantize_polygons cho từng lớp của layered_geometry (mọi lớp dùng chung ma trận)"""
+    quantized = [(color, *quantize_polygons(polygons, matrix, quantize_step)) for color, polygons in geometry]
+    new_matrix = quantized[0][2] if quantized else matrix
+    return [(color, polygons) for color, polygons, _ in quantized], new_matrix
+
+def _layered_content(geometry, matrix):
+    """Content stream của các lớp xếp chồng, mỗi lớp một khối q/Q với màu riêng"""
+    return b"".join(_page_content(polygons, matrix, color=color) for color, polygons in geometry if polygons)
+
+def add_layered_page(doc, geometry, matrix):
+    """
+    Thêm trang nhiều lớp từ layered_geometry. Không dùng ShapeTable: lỗ của
+    mỗi lớp chỉ được khoét khi mọi path của lớp nằm trong cùng một lệnh f*
+    """
+    add_content_page(doc, _layered_content(geometry, matrix))
+
+def _unoptimized_size(content):
+    """
+    Kích thước PDF một trang với content stream `content` khi không tối ưu,
+    để báo cáo mức tiết kiệm. Gọi trong _stage_alone('bytes_before') để
+    không cộng vào các bước render/serialize của trang thật
+    """
+    import fitz
+    doc = fitz.open()
+    try:
+        add_content_page(doc, content)
+        return len(doc.tobytes())
+    finally:
+        doc.close()
+
+def contours_to_pdf(contours, width, height, width_pt, height_pt, output_path,
+                    optimizations=frozenset(), quantize_step=QUANTIZE_STEP, epsilon=None):
+    """
+    Ghi contours trực tiếp vào PDF 144x144, chỉ áp dụng phép scale một lần
+    
+    Returns:
+        int | None: Kích thước PDF khi không tối ưu (chỉ tính khi có optimizations)
+    """
+    import fitz
+    polygons, matrix = page_geometry(contours, width, height, width_pt, height_pt, epsilon=epsilon)
+    page_polygons, page_matrix = polygons, matrix
+    if 'quantize' in optimizations:
+        page_polygons, page_matrix = quantize_polygons(polygons, matrix, quantize_step)
+    
+    doc = fitz.open()
+    try:
+        add_polygon_page(doc, page_polygons, page_matrix, ShapeTable(doc) if 'dedupe' in optimizations else None)
+        with _stage('write'):
+            doc.save(output_path, deflate='compress' in optimizations)
+        if not optimizations:
+            return None
+        with _stage_alone('bytes_before'):
+            # Cùng content stream: chỉ cần lưu lại trang đã có mà không nén
+            if page_matrix is matrix and 'dedupe' not in optimizations:
+                return len(doc.tobytes())
+            return _unoptimized_size(_page_content(polygons, matrix))
+    finally:
+        doc.close()
+
+def layers_to_pdf(layers, width, height, width_pt, height_pt, output_path,
+                  optimizations=frozenset(), quantize_step=QUANTIZE_STEP, epsilon=None):
+    """
+    Ghi các lớp của trace_layers vào một trang PDF 144x144, lớp sau vẽ đè lớp trước
+    ('dedupe' không áp dụng, xem add_layered_page)
+    
+    Returns:
+        int | None: Kích thước PDF khi không tối ưu (chỉ tính khi có optimizations)
+    """
+    import fitz
+    geometry, matrix = layered_geometry(layers, width, height, width_pt, height_pt, epsilon=epsilon)
+    page_layers, page_matrix = geometry, matrix
+    if 'quantize' in optimizations:
+        page_layers, page_matrix = quantize_layers(geometry, matrix, quantize_step)
+    
+    doc = fitz.open()
+    try:
+        add_layered_page(doc, page_layers, page_matrix)
+        with _stage('write'):
+            doc.save(output_path, deflate='compress' in optimizations)
+        if not optimizations:
+            return None
+        with _stage_alone('bytes_before'):
+            if page_matrix is matrix:
+                return len(doc.tobytes())
+            return _unoptimized_size(_layered_content(geometry, matrix))
+    finally:
+        doc.close()
+
+def add_raster_page(doc, mask, width, height, width_pt, height_pt):
+    """
+    Thêm trang vẽ mask 1-bit (255 = tô) bằng một image mask nén deflate, phủ
+    đúng vùng của ảnh gốc (width x height pixel) như page_transform
+    """
+    sx, _, _, d, e, f = page_transform(width, height, width_pt, height_pt)
+    rows, columns = mask.shape
+    xref = doc.get_new_xref()
+    doc.update_object(xref, f"<< /Type /XObject /Subtype /Image /Width {columns} /Height {rows} "
+                            f"/ImageMask true /BitsPerComponent 1 >>")
+    # Với ImageMask, bit 0 là điểm được tô
+    doc.update_stream(xref, np.packbits(mask == 0, axis=1).tobytes(), compress=True)
+    matrix = (width * sx, 0, 0, -height * d, e, f + height * d)
+    content = "q\n0 0 0 rg\n" + " ".join(_format_number(v) for v in matrix) + " cm\n/R1 Do\nQ\n"
+    add_content_page(doc, content.encode('ascii'), f"<< /XObject << /R1 {xref} 0 R >> >>")
+
+def raster_to_pdf(mask, width, height, width_pt, height_pt, output_path, optimizations=frozenset()):
+    """
+    Ghi trang raster (RasterFallback) ra PDF 144x144
+    
+    Returns:
+        int | None: Kích thước PDF (chỉ tính khi có optimizations, ảnh luôn được nén)
+    """
+    import fitz
+    doc = fitz.open()
+    try:
+        add_raster_page(doc, mask, width, height, width_pt, height_pt)
+        with _stage('write'):
+            doc.save(output_path, deflate='compress' in optimizations)
+        return len(doc.tobytes()) if optimizations else None
+    finally:
+        doc.close()
+
+def create_svg_document(path_data, width, height, width_pt, height_pt):
+    """Tạo SVG với kích thước thực (points) và viewBox theo pixel"""
+    svg = Element('svg', {
+        'xmlns': 'http://www.w3.org/2000/svg',
+        'width': f'{width_pt}pt',
+        'height': f'{height_pt}pt',
+        'viewBox': f'0 0 {width} {height}',
+        'preserveAspectRatio': 'none'
+    })
+    
+    g = SubElement(svg, 'g', {
+        'fill': 'black',
+        'stroke': 'none'
+    })
+    
+    if path_data:
+        path_element = SubElement(g, 'path', {
+            'd': path_data,
+            'style': 'fill-rule:evenodd'
+        })
+    
+    return svg
+
+def render_svg_to_pdf(svg):
+    """Render SVG sang PDF bằng svglib + reportlab, hoàn toàn trong bộ nhớ"""
+    # svglib/reportlab chỉ cần cho backend svg nên chỉ import khi dùng tới
+    from svglib.svglib import svg2rlg
+    from reportlab.graphics import renderPDF
     
-    return path_data
+    buffer = io.BytesIO()
+    ElementTree(svg).write(buffer, encoding='utf-8', xml_declaration=True)
+    buffer.seek(0)
+    drawing = svg2rlg(buffer)
+    return renderPDF.drawToString(drawing)
 
-def preprocess_image(image):
+def contours_to_pdf_svg(contours, width, height, width_pt, height_pt, output_path,
+                        precision=2, relative=False, optimizations=frozenset(), epsilon=None):
+    """
+    Ghi contours qua SVG -> svglib -> reportlab rồi resize bằng PyMuPDF (backend cũ).
+    Chỉ 'flatten' và 'compress' áp dụng cho backend này. Các bước trung gian
+    nằm trong bộ nhớ; output_path có thể là file-like object
+    
+    Returns:
+        int | None: Kích thước PDF khi không tối ưu (chỉ tính khi có optimizations)
+    """
+    path_data = create_svg_path_from_contours(contours, precision, relative, epsilon)
+    svg = create_svg_document(path_data, width, height, width_pt, height_pt)
+    
+    with _stage('render'):
+        rendered = render_svg_to_pdf(svg)
+    
+    # Resize PDF xuống 144x144
+    if 'flatten' in optimizations:
+        with _stage('resize'):
+            resize_pdf(rendered, output_path, True, 'compress' in optimizations)
+        with _stage_alone('bytes_before'):
+            plain = io.BytesIO()
+            resize_pdf(rendered, plain)
+            return len(plain.getvalue())
+    
+    with _stage('resize'):
+        resized = _resized_pdf(rendered)
+    try:
+        with _stage('resize'):
+            resized.save(output_path, deflate='compress' in optimizations)
+        if not optimizations:
+            return None
+        # Chỉ khác cách lưu: lưu lại cùng tài liệu mà không nén
+        with _stage_alone('bytes_before'):
+            return len(resized.tobytes())
+    finally:
+        resized.close()
+
+class BufferPool:
+    """
+    Bộ đệm uint8 dùng lại giữa các ảnh của một worker: mỗi tên giữ một mảng
+    bằng ảnh lớn nhất đã gặp, ảnh nhỏ hơn dùng phần đầu của mảng đó. Với
+    reuse=False mỗi lần get đều cấp phát mới (chỉ để đếm, dùng trong benchmark)
+    """
+    
+    def __init__(self, reuse=True):
+        self.reuse = reuse
+        self.buffers = {}
+        self.requests = 0
+        self.allocations = 0
+        self.allocated_bytes = 0
+    
+    def get(self, name, shape):
+        """Mảng uint8 liền với hình dạng shape; nội dung là dữ liệu cũ, chưa xóa"""
+        size = int(np.prod(shape))
+        self.requests += 1
+        buffer = self.buffers.get(name)
+        if not self.reuse or buffer is None or buffer.size < size:
+            buffer = np.empty(size, np.uint8)
+            self.allocations += 1
+            self.allocated_bytes += size
+            if self.reuse:
+                self.buffers[name] = buffer
+        return buffer[:size].reshape(shape)
+    
+    def held_bytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+    
+    def clear(self):
+        self.buffers.clear()
+
+# BufferPool của từng thread (mỗi process worker hoặc thread compute có bộ đệm riêng)
+_buffers = threading.local()
+
+def worker_buffer_pool():
+    """BufferPool của thread hiện tại, tạo khi dùng lần đầu"""
+    pool = getattr(_buffers, 'pool', None)
+    if pool is None:
+        pool = _buffers.pool = BufferPool()
+    return pool
+
+def _blurred_channel(image, pool=None):
+    """
+    Kênh được trace (alpha hoặc độ sáng) đã làm mờ. Với pool, kênh xám và
+    ảnh blur được ghi vào bộ đệm 'channel' và 'blurred' của pool
+    """
+    import cv2
+    channel = image
     if len(image.shape) > 2:
+        dst = pool.get('channel', image.shape[:2]) if pool is not None else None
         if image.shape[2] == 4:
-            image = image[:, :, 3]
+            channel = cv2.extractChannel(image, 3, dst)
         else:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            channel = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst)
+    dst = pool.get('blurred', channel.shape) if pool is not None else None
+    return cv2.GaussianBlur(channel, BLUR_KERNEL, BLUR_SIGMA, dst=dst)
+
+def normalize_image(image, pool=None):
+    """Kênh được trace (alpha hoặc độ sáng), đã làm mờ và giãn về 0..255 (ghi đè lên ảnh blur)"""
+    import cv2
+    blurred = _blurred_channel(image, pool)
+    return cv2.normalize(blurred, blurred, 0, 255, cv2.NORM_MINMAX)
+
+def binary_cutoff(low, high):
+    """
+    Ngưỡng trên ảnh blur (min low, max high) tương đương với normalize về
+    0..255 rồi threshold THRESHOLD: pixel > giá trị trả về thành 255. Các
+    giá trị low..high được ánh xạ bằng chính cv2.normalize nên làm tròn giống hệt
+    """
+    import cv2
+    ramp = np.arange(low, high + 1, dtype=np.uint8)
+    mapped = cv2.normalize(ramp, None, 0, 255, cv2.NORM_MINMAX)
+    return low + int(np.count_nonzero(mapped <= THRESHOLD)) - 1
+
+def preprocess_image(image, pool=None):
+    """
+    Ảnh nhị phân của kênh được trace. Normalize và threshold được gộp làm
+    một: ngưỡng tính từ min/max của ảnh blur (binary_cutoff) rồi threshold
+    ngay trên ảnh blur, không giãn cả ảnh. Với pool, kết quả nằm trong bộ
+    đệm của pool và chỉ dùng được tới lần gọi kế tiếp
+    """
+    import cv2
+    blurred = _blurred_channel(image, pool)
+    low, high, _, _ = cv2.minMaxLoc(blurred)
+    cv2.threshold(blurred, binary_cutoff(int(low), int(high)), 255, cv2.THRESH_BINARY, dst=blurred)
+    return blurred
+
+def find_contours(binary):
+    """Tìm contours ngoài cùng trên ảnh nhị phân"""
+    import cv2
+    contours, _ = cv2.findContours(
+        binary,
+        cv2.RETR_EXTERNAL,
+        cv2.CHAIN_APPROX_TC89_KCOS
+    )
+    return contours
+
+def trace_contours(image, tile_size=None, min_area=MIN_CONTOUR_AREA):
+    """
+    Xử lý ảnh, tìm và lọc contours (diện tích > min_area pixel, None = không
+    lọc). Với tile_size, ảnh cao hơn tile_size được xử lý theo từng dải (xem
+    trace_contours_tiled)
+    """
+    if tile_size and image.shape[0] > tile_size:
+        with _stage('tiled_trace'):
+            contours = trace_contours_tiled(image, tile_size)
+    else:
+        pool = worker_buffer_pool()
+        allocations = pool.allocations
+        with _stage('preprocess'):
+            binary = preprocess_image(image, pool)
+        _count('buffer_allocations', pool.allocations - allocations)
+        with _stage('find_contours'):
+            contours = find_contours(binary)
+    _count('raw_contours', len(contours))
+    _count('raw_vertices', sum(len(cnt) for cnt in contours))
     
-    image = cv2.GaussianBlur(image, (5,5), 0.5)
-    image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX)
-    _, binary = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
+    # Lọc contours
+    if min_area is not None:
+        with _stage('filter'):
+            contours = filter_contours(contours, min_area)
+    _count('contours', len(contours))
+    return contours
+
+def quantize_levels(image, levels):
+    """
+    Chia kênh của preprocess_image thành `levels` mức đều nhau, dùng chung
+    bước làm mờ/giãn; nhãn càng cao thì mực càng đậm (levels=2 gần giống
+    ngưỡng THRESHOLD)
     
-    return binary
+    Returns:
+        tuple: (ảnh nhãn uint8, màu RGB 0..1 của từng nhãn; nhãn 0 là nền)
+    """
+    import cv2
+    normalized = normalize_image(image, worker_buffer_pool())
+    lut = (np.arange(256) * levels // 256).astype(np.uint8)
+    labels = cv2.LUT(normalized, lut)
+    colors = [(1 - level / (levels - 1),) * 3 for level in range(levels)]
+    return labels, colors
 
-def resize_pdf(input_path, output_path):
-    """Scale PDF về kích thước 144x144"""
-    try:
-        # Đọc file PDF gốc
-        doc = fitz.open(input_path)
-        page = doc[0]
+def quantize_palette(image, colors, sample_size=PALETTE_SAMPLE, seed=0):
+    """
+    Gom màu ảnh (BGR, đã làm mờ) thành `colors` màu bằng k-means trên một mẫu
+    pixel rồi gán mọi pixel cho màu gần nhất. Nhãn được xếp theo số pixel
+    giảm dần: nhãn 0 (màu phổ biến nhất) được coi là nền
+    
+    Returns:
+        tuple: (ảnh nhãn uint8, màu RGB 0..1 của từng nhãn)
+    """
+    import cv2
+    if len(image.shape) == 2:
+        return quantize_levels(image, colors)
+    bgr = cv2.GaussianBlur(image[:, :, :3], BLUR_KERNEL, BLUR_SIGMA)
+    pixels = bgr.reshape(-1, 3)
+    rng = np.random.default_rng(seed)
+    sample = pixels[rng.choice(len(pixels), min(sample_size, len(pixels)), replace=False)].astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.5)
+    cv2.setRNGSeed(seed)
+    _, _, centers = cv2.kmeans(sample, colors, None, criteria, 3, cv2.KMEANS_PP_CENTERS)
+    
+    # Gán pixel cho tâm gần nhất, mỗi lần một tâm để không tạo mảng (N, K, 3)
+    best = np.full(len(pixels), np.inf, np.float32)
+    labels = np.zeros(len(pixels), np.uint8)
+    for index, center in enumerate(centers):
+        distance = np.square(pixels - center, dtype=np.float32).sum(axis=1)
+        closer = distance < best
+        best[closer] = distance[closer]
+        labels[closer] = index
+    
+    order = np.argsort(-np.bincount(labels, minlength=colors), kind='stable')
+    rank = np.empty(colors, np.uint8)
+    rank[order] = np.arange(colors)
+    labels = rank[labels].reshape(image.shape[:2])
+    return labels, [tuple(float(v) / 255 for v in centers[index][::-1]) for index in order]
+
+def find_layer_contours(labels, count):
+    """
+    Contours của từng lớp i = 1..count-1 trên cùng một ảnh nhãn: lớp i phủ
+    mọi pixel có nhãn >= i, nên các lớp xếp chồng không để lộ khe giữa hai
+    màu. Giữ cả contour lỗ (RETR_CCOMP, tô even-odd) để lớp dưới lộ ra
+    
+    Returns:
+        list: Danh sách contours của từng lớp (lớp trống là [])
+    """
+    import cv2
+    layers = []
+    mask = np.empty(labels.shape, np.uint8)
+    for level in range(1, count):
+        cv2.threshold(labels, level - 1, 255, cv2.THRESH_BINARY, dst=mask)
+        if not cv2.countNonZero(mask):
+            # Các lớp lồng nhau: lớp này trống thì các lớp sau cũng trống
+            layers.extend([] for _ in range(level, count))
+            break
+        contours, _ = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_TC89_KCOS)
+        layers.append(list(contours))
+    return layers
+
+def trace_layers(image, levels, palette=False, min_area=MIN_CONTOUR_AREA):
+    """
+    Trace ảnh thành nhiều lớp màu: lượng tử hóa một lần (quantize_levels
+    hoặc quantize_palette), rồi tìm contours cho mọi lớp trên ảnh nhãn đó
+    
+    Returns:
+        list: Các lớp (màu RGB 0..1, contours) theo thứ tự vẽ; nền chỉ được
+            vẽ (một hình chữ nhật phủ cả ảnh) khi không phải màu trắng
+    """
+    with _stage('preprocess'):
+        if palette:
+            labels, colors = quantize_palette(image, levels)
+        else:
+            labels, colors = quantize_levels(image, levels)
+    with _stage('find_contours'):
+        layers = find_layer_contours(labels, len(colors))
+    _count('raw_contours', sum(len(contours) for contours in layers))
+    if min_area is not None:
+        with _stage('filter'):
+            layers = [filter_contours(contours, min_area) for contours in layers]
+    _count('contours', sum(len(contours) for contours in layers))
+    layers = list(zip(colors[1:], layers))
+    # Với palette, nền là màu phổ biến nhất và có thể tối hoặc có màu: không
+    # tô nó thì các lớp sáng hơn sẽ lẫn vào trang trắng
+    if min(colors[0]) < WHITE_BACKGROUND:
+        height, width = labels.shape
+        frame = np.array([[[0, 0]], [[width, 0]], [[width, height]], [[0, height]]], np.int32)
+        layers.insert(0, (colors[0], [frame]))
+    return layers
+
+def working_level(width, height, width_pt, height_pt, output_dpi=OUTPUT_DPI):
+    """
+    Số tầng pyrDown để mỗi pixel vẫn không lớn hơn một pixel đầu ra ở
+    output_dpi trên trang 144x144
+    """
+    sx, _, _, d, _, _ = page_transform(width, height, width_pt, height_pt)
+    pixel_pt = min(sx, -d)
+    level = 0
+    while pixel_pt * 2 ** (level + 1) <= 72 / output_dpi and min(width, height) >> (level + 1) >= 16:
+        level += 1
+    return level
+
+def fill_holes(binary):
+    """Tô kín các lỗ trong vùng trắng, giống kết quả tô contour RETR_EXTERNAL"""
+    import cv2
+    padded = cv2.copyMakeBorder(binary, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    # Tô nền nối với viền ảnh (4 hướng), phần còn lại là vùng trắng và các lỗ
+    cv2.floodFill(padded, None, (0, 0), 255)
+    return binary | cv2.bitwise_not(padded[1:-1, 1:-1])
+
+def trace_error(contours, reference):
+    """
+    Tỷ lệ pixel mà các contour đã tô kín khác ảnh nhị phân reference (cùng
+    lưới pixel), không tính dải 1 pixel quanh biên: chỉ đo các chi tiết bị mất
+    hoặc thừa, không đo độ lệch nhỏ của đường biên
+    """
+    import cv2
+    traced = np.zeros(reference.shape, np.uint8)
+    cv2.drawContours(traced, contours, -1, 255, cv2.FILLED)
+    expected = fill_holes(reference)
+    edge = cv2.morphologyEx(expected, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+    wrong = np.count_nonzero((traced ^ expected) & ~edge)
+    total = np.count_nonzero(traced | expected)
+    return wrong / total if total else 0.0
+
+def _grow_contours(contours, distance):
+    """
+    Đẩy mỗi điểm ra ngoài `distance` pixel theo pháp tuyến. Contour đi qua tâm
+    các pixel biên nên nằm lùi vào trong nửa pixel; ở ảnh thu nhỏ phần lùi này
+    lớn hơn và làm nét mảnh bị gầy đi
+    """
+    import cv2
+    grown = []
+    for contour in contours:
+        points = contour.reshape(-1, 2).astype(np.float32)
+        tangent = np.roll(points, -1, axis=0) - np.roll(points, 1, axis=0)
+        length = np.hypot(tangent[:, 0], tangent[:, 1])
+        length[length == 0] = np.inf
+        normal = np.stack([tangent[:, 1], -tangent[:, 0]], axis=1) / length[:, None]
+        # Chiều pháp tuyến hướng ra ngoài phụ thuộc chiều đi của contour
+        if cv2.contourArea(points, oriented=True) < 0:
+            normal = -normal
+        grown.append((points + normal * distance).reshape(-1, 1, 2))
+    return grown
+
+def trace_output_resolution(image, width_pt, height_pt, output_dpi=OUTPUT_DPI,
+                            tolerance_pt=TOLERANCE_PT, max_error=MAX_TRACE_ERROR):
+    """
+    Trace ở độ phân giải đầu ra: thu nhỏ ảnh bằng image pyramid, tìm contours
+    trên ảnh nhỏ rồi đưa tọa độ về pixel gốc
+    
+    Quality guard: contour ở ảnh nhỏ được so với ảnh nhị phân gốc (thu nhỏ
+    bằng cùng image pyramid để trùng lưới pixel); sai lệch lớn hơn max_error
+    (xem trace_error) nghĩa là chi tiết mảnh bị mất khi thu nhỏ
+    
+    Returns:
+        tuple | None: (contours theo pixel gốc (int32), epsilon theo pixel gốc ứng với
+            tolerance_pt), hoặc None khi không qua quality guard
+    """
+    import cv2
+    height, width = image.shape[:2]
+    sx, _, _, d, _, _ = page_transform(width, height, width_pt, height_pt)
+    epsilon = tolerance_pt / min(sx, -d)
+    level = working_level(width, height, width_pt, height_pt, output_dpi)
+    _count('level', level)
+    if level == 0:
+        return trace_contours(image), epsilon
+    
+    with _stage('pyramid'):
+        small = image
+        for _ in range(level):
+            small = cv2.pyrDown(small)
+    factor = 2 ** level
+    contours = trace_contours(small, min_area=MIN_CONTOUR_AREA / factor ** 2)
+    
+    with _stage('quality_check'):
+        reference = preprocess_image(image)
+        for _ in range(level):
+            reference = cv2.pyrDown(reference)
+        _, reference = cv2.threshold(reference, THRESHOLD, 255, cv2.THRESH_BINARY)
+        error = trace_error(contours, reference)
+    _count('trace_error', round(float(error), 5))
+    if error > max_error:
+        return None
+    
+    # Pixel i ở tầng `level` được lấy mẫu từ pixel i * factor của ảnh gốc; bù
+    # phần biên lùi vào thêm so với khi trace ở ảnh gốc. Làm tròn về pixel gốc
+    # (nhỏ hơn nửa pixel đầu ra) để tọa độ được ghi thành số nguyên như khi
+    # trace ở ảnh gốc thay vì số thực "%.2f"
+    contours = _grow_contours([cnt * factor for cnt in contours], (factor - 1) / 2)
+    return [np.rint(cnt).astype(np.int32) for cnt in contours], epsilon
+
+def _blurred_strip(image, y0, y1):
+    """
+    Kênh xám/alpha đã blur của các hàng y0..y1. Lấy thêm vài hàng ở hai đầu
+    để GaussianBlur cho kết quả giống hệt khi blur cả ảnh
+    """
+    import cv2
+    pad = BLUR_KERNEL[1] // 2
+    top = max(0, y0 - pad)
+    bottom = min(image.shape[0], y1 + pad)
+    
+    strip = image[top:bottom]
+    if len(strip.shape) > 2:
+        if strip.shape[2] == 4:
+            strip = strip[:, :, 3]
+        else:
+            strip = cv2.cvtColor(strip, cv2.COLOR_BGR2GRAY)
+    
+    blurred = cv2.GaussianBlur(strip, BLUR_KERNEL, BLUR_SIGMA)
+    return blurred[y0 - top:y1 - top]
+
+def _open_components(buffer):
+    """Mask (0/1) các thành phần liên thông chạm hàng cuối của buffer (chưa khép kín)"""
+    import cv2
+    height, width = buffer.shape
+    mask = np.zeros((height + 2, width + 2), np.uint8)
+    bottom = buffer[-1] > 0
+    # Chỉ cần tô từ điểm đầu của mỗi đoạn liên tiếp ở hàng cuối
+    starts = np.flatnonzero(bottom & ~np.concatenate(([False], bottom[:-1])))
+    for x in starts.tolist():
+        if not mask[height, x + 1]:
+            cv2.floodFill(buffer, mask, (x, height - 1), 0, 0, 0,
+                          8 | cv2.FLOODFILL_MASK_ONLY | (1 << 8))
+    return mask[1:-1, 1:-1]
+
+def _drop_nested(contours, spanning):
+    """
+    Bỏ các contour nằm trong lỗ của contour khác. Chỉ contour trải qua nhiều
+    dải mới có thể chứa contour đã được ghi nhận ở dải trước (RETR_EXTERNAL
+    trong từng buffer đã xử lý các trường hợp còn lại)
+    """
+    import cv2
+    if not spanning or len(contours) < 2:
+        return contours
+    
+    boxes = np.array([cv2.boundingRect(cnt) for cnt in contours])
+    x0, y0 = boxes[:, 0], boxes[:, 1]
+    x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+    keep = np.ones(len(contours), bool)
+    
+    for i in spanning:
+        candidates = np.flatnonzero(keep & (x0 >= x0[i]) & (y0 >= y0[i]) & (x1 <= x1[i]) & (y1 <= y1[i]))
+        outer = contours[i]
+        for j in candidates.tolist():
+            if j == i:
+                continue
+            x, y = contours[j][0, 0]
+            if cv2.pointPolygonTest(outer, (float(x), float(y)), False) > 0:
+                keep[j] = False
+    
+    return [cnt for cnt, kept in zip(contours, keep) if kept]
+
+def trace_contours_tiled(image, tile_size=1024):
+    """
+    Tìm contours theo từng dải ngang cao tile_size hàng mà không tạo ảnh xám,
+    ảnh blur, ảnh normalize hay ảnh nhị phân kích thước đầy đủ.
+    
+    Thành phần nào chạm đáy dải được giữ lại (chỉ các pixel của nó) và ghép
+    vào dải kế tiếp cho tới khi khép kín, nên contour của nó giống hệt khi
+    tracing cả ảnh. Bộ nhớ tăng theo kích thước dải cộng với chiều cao của
+    các hình vắt qua ranh giới dải.
+    """
+    import cv2
+    height = image.shape[0]
+    bands = [(y0, min(y0 + tile_size, height)) for y0 in range(0, height, tile_size)]
+    
+    # Lượt 1: min/max toàn ảnh sau blur, vì normalize dùng giá trị toàn cục
+    low, high = 255.0, 0.0
+    for y0, y1 in bands:
+        strip_low, strip_high, _, _ = cv2.minMaxLoc(_blurred_strip(image, y0, y1))
+        low, high = min(low, strip_low), max(high, strip_high)
+    
+    # Gộp normalize + threshold như cv2.normalize(NORM_MINMAX)
+    scale = 255.0 / (high - low) if high - low > 0 else 0.0
+    shift = -low * scale
+    
+    # Lượt 2: threshold và tìm contours từng dải
+    contours = []
+    spanning = []  # Chỉ số các contour trải qua nhiều dải
+    carry = None
+    carry_top = 0
+    for y0, y1 in bands:
+        normalized = cv2.convertScaleAbs(_blurred_strip(image, y0, y1), alpha=scale, beta=shift)
+        _, binary = cv2.threshold(normalized, THRESHOLD, 255, cv2.THRESH_BINARY)
         
-        # Lấy kích thước hiện tại
-        rect = page.rect
-        width = float(rect.width)
-        height = float(rect.height)
+        if carry is not None:
+            buffer = np.vstack((carry, binary))
+            top = carry_top
+        else:
+            buffer = binary
+            top = y0
         
-        # Tính tỷ lệ scale
-        scale = 144 / max(width, height)
+        last = y1 == height
+        open_mask = None if last else _open_components(buffer)
         
-        # Tạo PDF mới với kích thước 144x144
-        new_doc = fitz.open()
-        new_page = new_doc.new_page(width=144, height=144)
+        for contour in find_contours(buffer):
+            x, y = contour[0, 0]
+            if open_mask is not None and open_mask[y, x]:
+                continue  # Chưa khép kín, sẽ tìm lại ở dải sau
+            if top < y0 and y < y0 - top:
+                spanning.append(len(contours))
+            contour[:, 0, 1] += top
+            contours.append(contour)
         
-        # Scale nội dung
-        matrix = fitz.Matrix(scale, scale)
-        new_page.show_pdf_page(new_page.rect, doc, 0, matrix)
+        carry = None
+        if open_mask is not None:
+            rows = np.flatnonzero(open_mask.any(axis=1))
+            if len(rows):
+                carry = open_mask[rows[0]:] * np.uint8(255)
+                carry_top = top + int(rows[0])
+    
+    return _drop_nested(contours, spanning)
+
+def _open_pdf(source):
+    """Mở PDF từ đường dẫn hoặc từ nội dung bytes"""
+    import fitz
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype='pdf')
+    return fitz.open(source)
+
+def _flatten_resize(input_path, output_path, deflate=False):
+    """
+    Scale trang đầu về 144x144 ngay trong tài liệu gốc: bọc content stream
+    bằng một phép cm và đổi MediaBox, không tạo Form XObject như show_pdf_page
+    """
+    import fitz
+    doc = _open_pdf(input_path)
+    try:
+        page = doc[0]
+        rect = page.rect
+        scale = TARGET_SIZE / max(rect.width, rect.height)
+        offset_x = (TARGET_SIZE - rect.width * scale) / 2
+        offset_y = (TARGET_SIZE - rect.height * scale) / 2
         
-        # Lưu file
-        new_doc.save(output_path)
+        xrefs = page.get_contents()
+        content = b"\n".join(doc.xref_stream(xref) for xref in xrefs)
+        matrix = " ".join(_format_number(v) for v in (scale, 0, 0, scale, offset_x, offset_y))
+        doc.update_stream(xrefs[0], f"q {matrix} cm\n".encode('ascii') + content + b"\nQ\n")
+        if len(xrefs) > 1:
+            doc.xref_set_key(page.xref, "Contents", f"{xrefs[0]} 0 R")
         
-        # Đóng các file
+        page.set_mediabox(fitz.Rect(0, 0, TARGET_SIZE, TARGET_SIZE))
+        doc.save(output_path, garbage=3, deflate=deflate)
+    finally:
         doc.close()
+
+def resize_pdf(input_path, output_path, flatten=False, deflate=False):
+    """
+    Scale PDF về kích thước 144x144 (input là đường dẫn hoặc bytes, output là
+    đường dẫn hoặc file-like). Lỗi được báo bằng exception để nơi gọi ghi nhận
+    """
+    if flatten:
+        _flatten_resize(input_path, output_path, deflate)
+        return
+    
+    new_doc = _resized_pdf(input_path)
+    try:
+        new_doc.save(output_path, deflate=deflate)
+    finally:
         new_doc.close()
+
+def _resized_pdf(input_path):
+    """Tài liệu mới một trang 144x144 chứa trang đầu của input_path (đường dẫn hoặc bytes) đã scale"""
+    import fitz
+    # Đọc file PDF gốc
+    doc = _open_pdf(input_path)
+    page = doc[0]
+    
+    # Lấy kích thước hiện tại
+    rect = page.rect
+    width = float(rect.width)
+    height = float(rect.height)
+    
+    # Tính tỷ lệ scale
+    scale = 144 / max(width, height)
+    
+    # Tạo PDF mới với kích thước 144x144
+    new_doc = fitz.open()
+    new_page = new_doc.new_page(width=144, height=144)
+    
+    # Scale nội dung
+    matrix = fitz.Matrix(scale, scale)
+    new_page.show_pdf_page(new_page.rect, doc, 0, matrix)
+    
+    doc.close()
+    return new_doc
+
+def decode_image(buffer, name):
+    """
+    Đọc DPI từ header và giải mã pixel của ảnh đã nằm trong bộ nhớ (bytes hoặc mmap)
+    
+    Returns:
+        tuple: (ảnh numpy, (dpi_x, dpi_y)); mặc định 96 DPI nếu không có thông tin
+    """
+    import cv2
+    if len(buffer) == 0:
+        raise ValueError(f"Không thể đọc file {name}")
+    header = read_image_header(buffer)
+    data = np.frombuffer(buffer, np.uint8)
+    img = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+    del data  # Bỏ tham chiếu tới buffer để mmap đóng được
+    
+    if img is None:
+        raise ValueError(f"Không thể đọc file {name}")
+    
+    return img, header['dpi'] or (96, 96)
+
+def load_image(input_path):
+    """
+    Đọc DPI từ header và giải mã pixel đúng một lần, cùng trên một buffer mmap
+    
+    Returns:
+        tuple: (ảnh numpy, (dpi_x, dpi_y)); mặc định 96 DPI nếu không có thông tin
+    """
+    with open(input_path, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # File rỗng: decode_image báo lỗi giống khi đọc từ bytes (pipeline)
+            return decode_image(b'', os.path.basename(input_path))
         
-        print(f"Đã resize PDF xuống 144x144")
-        
-    except Exception as e:
-        print(f"Lỗi khi resize PDF: {str(e)}")
+        with buffer:
+            return decode_image(buffer, os.path.basename(input_path))
 
-def image_to_pdf(input_dir, output_dir):
+class RasterFallback:
+    """Ảnh 1-bit (255 = tô) ở OUTPUT_DPI thay cho contours khi vượt ngân sách vẽ"""
+    
+    def __init__(self, mask):
+        self.mask = mask
+
+# Chính sách ngân sách vẽ đã dùng cho ảnh vừa trace trong thread hiện tại
+_budget_log = threading.local()
+
+def take_budget_log():
+    """Lấy (và xóa) bản ghi ngân sách vẽ của ảnh vừa trace, None nếu ảnh nằm trong ngân sách"""
+    entry = getattr(_budget_log, 'entry', None)
+    _budget_log.entry = None
+    return entry
+
+def render_cost(contours):
+    """
+    Số contour, số điểm và số bytes của các toán tử path (m/l/h) khi ghi như
+    format_pdf_path, tính từ số chữ số của từng tọa độ mà không tạo chuỗi
+    """
+    if not contours:
+        return {'contours': 0, 'vertices': 0, 'bytes': 0}
+    points = np.concatenate([cnt.reshape(-1, 2) for cnt in contours])
+    integer = np.issubdtype(points.dtype, np.integer)
+    values = np.abs(points.astype(np.float64))
+    if not integer:
+        values = np.round(values, 2)
+    digits = np.floor(np.log10(np.maximum(values, 1))).astype(np.int64) + 1
+    chars = int(digits.sum()) + int(np.count_nonzero(points < 0))
+    if not integer:
+        chars += 3 * points.size  # Phần ".dd" của "%.2f"
+    # Mỗi điểm thêm dấu cách và " m\n"/" l\n", mỗi contour thêm "h\n"
+    return {'contours': len(contours), 'vertices': len(points),
+            'bytes': chars + 4 * len(points) + 2 * len(contours)}
+
+def over_budget(cost, budget):
+    """Tên các giới hạn bị vượt, rỗng nếu nằm trong ngân sách"""
+    return [name for name, limit in budget.items() if limit is not None and cost[name] > limit]
+
+def raster_mask(image, width_pt, height_pt, output_dpi=OUTPUT_DPI):
+    """
+    Vùng được tô (preprocess_image, đã lấp lỗ như khi tô contour ngoài cùng)
+    thu về độ phân giải output_dpi trên trang 144x144
+    
+    Returns:
+        ndarray: Ảnh uint8 0/255
+    """
+    import cv2
+    height, width = image.shape[:2]
+    sx, _, _, d, _, _ = page_transform(width, height, width_pt, height_pt)
+    size = (max(1, round(width * sx * output_dpi / 72)), max(1, round(height * -d * output_dpi / 72)))
+    binary = fill_holes(preprocess_image(image, worker_buffer_pool()))
+    small = cv2.resize(binary, size, interpolation=cv2.INTER_AREA)
+    _, mask = cv2.threshold(small, THRESHOLD, 255, cv2.THRESH_BINARY)
+    return mask
+
+def _fit_budget(img, contours, width_pt, height_pt, budget, policy):
+    """
+    Áp dụng chính sách cho contours vượt ngân sách
+    
+    Returns:
+        tuple: (contours đã đơn giản hóa hoặc RasterFallback, epsilon, bản ghi
+            {'policy', 'exceeded', 'contours', 'vertices', 'bytes', ...})
+    """
+    cost = render_cost(contours)
+    entry = dict(cost, exceeded=over_budget(cost, budget), policy=policy)
+    if policy == 'simplify':
+        height, width = img.shape[:2]
+        sx, _, _, d, _, _ = page_transform(width, height, width_pt, height_pt)
+        pixel_pt = min(sx, -d)
+        tolerance = TOLERANCE_PT
+        with _stage('budget_simplify'):
+            while tolerance <= MAX_BUDGET_TOLERANCE_PT:
+                # Bỏ luôn các hình nhỏ hơn hai lần sai số
+                simplified = simplify_contours(contours, tolerance / pixel_pt, 'dp',
+                                               MIN_CONTOUR_AREA, 2 * tolerance / pixel_pt)
+                if not over_budget(render_cost(simplified), budget):
+                    entry['tolerance_pt'] = tolerance
+                    return simplified, 0, entry
+                tolerance *= 2
+        entry['policy'] = 'raster'  # Đơn giản hóa tối đa vẫn vượt ngân sách
+    with _stage('raster'):
+        return RasterFallback(raster_mask(img, width_pt, height_pt)), None, entry
+
+def _trace_input(input_path, tile_size=None, resolution='source', simplify='opencv', data=None,
+                 levels=None, palette=False, render_budget=None, budget_policy='simplify'):
+    """
+    Đọc ảnh, tính kích thước thực và tìm contours. Với resolution='output',
+    trace ở độ phân giải đầu ra (trace_output_resolution) và chỉ quay về ảnh
+    gốc (có dùng tile_size) khi không qua quality guard. Với simplify='dp'/'vw',
+    contours được lọc theo MIN_FEATURE_PT và đơn giản hóa ngay (epsilon = 0).
+    Nếu có data (nội dung file đã đọc sẵn) thì giải mã từ đó thay vì đọc file.
+    Với levels, trace nhiều lớp (trace_layers) ở độ phân giải gốc. Với
+    render_budget, contours vượt ngân sách được xử lý theo budget_policy
+    (xem _fit_budget), chính sách đã dùng lấy bằng take_budget_log()
+    
+    Returns:
+        tuple: (contours, width, height, width_pt, height_pt, epsilon), epsilon
+            là sai số đơn giản hóa theo pixel (None = EPSILON_FACTOR * chu vi);
+            với levels, contours là danh sách lớp (màu, contours); với chính
+            sách raster, contours là RasterFallback
+    """
+    # Đọc ảnh và lấy DPI
+    with _stage('decode'):
+        if data is None:
+            img, dpi = load_image(input_path)
+        else:
+            img, dpi = decode_image(data, os.path.basename(input_path))
+    return _trace_image(img, dpi, tile_size, resolution, simplify, levels, palette, render_budget, budget_policy)
+
+def _simplify_layers(layers, epsilon, method, min_area, min_size):
+    """Lọc từng lớp rồi đơn giản hóa contours của mọi lớp trong một lần gọi simplify_contours"""
+    layers = [(color, filter_contours(contours, min_area, min_size)) for color, contours in layers]
+    simplified = simplify_contours([cnt for _, contours in layers for cnt in contours], epsilon, method)
+    result = []
+    start = 0
+    for color, contours in layers:
+        result.append((color, simplified[start:start + len(contours)]))
+        start += len(contours)
+    return result
+
+def _trace_image(img, dpi, tile_size=None, resolution='source', simplify='opencv', levels=None, palette=False,
+                 render_budget=None, budget_policy='simplify'):
+    """Phần của _trace_input sau khi đã giải mã ảnh, dpi là (dpi_x, dpi_y)"""
+    dpi_x, dpi_y = dpi
+    # Tính kích thước thực tế (inch)
+    height, width = img.shape[:2]
+    _count('pixels', width * height)
+    width_inch = width / dpi_x
+    height_inch = height / dpi_y
+    
+    # Chuyển đổi inch sang points (1 inch = 72 points)
+    width_pt = width_inch * 72
+    height_pt = height_inch * 72
+    
+    engine = simplify != 'opencv'
+    if levels:
+        layers = trace_layers(img, levels, palette, None if engine else MIN_CONTOUR_AREA)
+        if not engine:
+            return layers, width, height, width_pt, height_pt, None
+        sx, _, _, d, _, _ = page_transform(width, height, width_pt, height_pt)
+        pixel_pt = min(sx, -d)
+        with _stage('simplify'):
+            layers = _simplify_layers(layers, TOLERANCE_PT / pixel_pt, simplify,
+                                      MIN_CONTOUR_AREA, MIN_FEATURE_PT / pixel_pt)
+        _count('contours', sum(len(contours) for _, contours in layers))
+        return layers, width, height, width_pt, height_pt, 0
+    
+    traced = None
+    if resolution == 'output':
+        traced = trace_output_resolution(img, width_pt, height_pt)
+        if traced is None:
+            _count('fallback', 1)
+    
+    if traced is not None:
+        contours, epsilon = traced
+        min_area = MIN_CONTOUR_AREA
+    else:
+        # Xử lý ảnh, tìm và lọc contours (engine lọc diện tích cùng lúc với đơn giản hóa)
+        contours = trace_contours(img, tile_size, None if engine else MIN_CONTOUR_AREA)
+        epsilon = None
+        min_area = MIN_CONTOUR_AREA
+    
+    if engine:
+        sx, _, _, d, _, _ = page_transform(width, height, width_pt, height_pt)
+        pixel_pt = min(sx, -d)
+        with _stage('simplify'):
+            contours = simplify_contours(contours, TOLERANCE_PT / pixel_pt, simplify,
+                                         min_area, MIN_FEATURE_PT / pixel_pt)
+        _count('contours', len(contours))
+        epsilon = 0
+    
+    if render_budget and over_budget(render_cost(contours), render_budget):
+        contours, epsilon, entry = _fit_budget(img, contours, width_pt, height_pt, render_budget, budget_policy)
+        _budget_log.entry = entry
+        _count('budget_policy', entry['policy'])
+    return contours, width, height, width_pt, height_pt, epsilon
+
+def convert_image(input_path, output_path, backend='native', tile_size=None,
+                  optimizations=frozenset(), quantize_step=QUANTIZE_STEP, resolution='source',
+                  simplify='opencv', data=None, levels=None, palette=False, render_budget=None,
+                  budget_policy='simplify'):
+    """
+    Chuyển một file ảnh thành PDF 144x144, báo lỗi bằng exception.
+    output_path có thể là file-like object (ví dụ io.BytesIO). Với levels,
+    trang gồm các lớp màu xếp chồng (trace_layers)
+    
+    Returns:
+        int | None: Kích thước PDF khi không tối ưu, để so sánh (None nếu không có optimizations)
+    """
+    contours, width, height, width_pt, height_pt, epsilon = _trace_input(input_path, tile_size, resolution,
+                                                                         simplify, data, levels, palette,
+                                                                         render_budget, budget_policy)
+    
+    return _write_traced(contours, width, height, width_pt, height_pt, epsilon, output_path,
+                         backend, optimizations, quantize_step, bool(levels))
+
+def _write_traced(contours, width, height, width_pt, height_pt, epsilon, output_path,
+                  backend='native', optimizations=frozenset(), quantize_step=QUANTIZE_STEP, layered=False):
+    """Ghi contours (hoặc các lớp khi layered) ra PDF bằng backend đã chọn, trả về kích thước khi không tối ưu"""
+    if isinstance(contours, RasterFallback):
+        return raster_to_pdf(contours.mask, width, height, width_pt, height_pt, output_path, optimizations)
+    if layered:
+        return layers_to_pdf(contours, width, height, width_pt, height_pt, output_path,
+                             optimizations, quantize_step, epsilon)
+    if backend == 'native':
+        return contours_to_pdf(contours, width, height, width_pt, height_pt, output_path,
+                               optimizations, quantize_step, epsilon)
+    return contours_to_pdf_svg(contours, width, height, width_pt, height_pt, output_path,
+                               optimizations=optimizations, epsilon=epsilon)
+
+def trace_params(backend='native', optimizations=frozenset(), quantize_step=QUANTIZE_STEP,
+                 resolution='source', simplify='opencv', levels=None, palette=False,
+                 render_budget=None, budget_policy='simplify'):
+    """Tất cả tham số ảnh hưởng tới file PDF đầu ra, dùng làm một phần của khóa cache"""
+    output_mode = resolution == 'output'
+    engine = simplify != 'opencv'
+    return {
+        'render_budget': render_budget,
+        'budget_policy': budget_policy if render_budget else None,
+        'max_budget_tolerance_pt': MAX_BUDGET_TOLERANCE_PT if render_budget else None,
+        'levels': levels,
+        'palette': bool(levels and palette),
+        'palette_sample': PALETTE_SAMPLE if levels and palette else None,
+        'white_background': WHITE_BACKGROUND if levels else None,
+        'simplify': simplify,
+        'min_feature_pt': MIN_FEATURE_PT if engine else None,
+        'resolution': resolution,
+        'output_dpi': OUTPUT_DPI if output_mode else None,
+        'tolerance_pt': TOLERANCE_PT if output_mode or engine else None,
+        'max_trace_error': MAX_TRACE_ERROR if output_mode else None,
+        'optimizations': sorted(optimizations),
+        'quantize_step': quantize_step if 'quantize' in optimizations else None,
+        'version': CACHE_VERSION,
+        'backend': backend,
+        'blur_kernel': list(BLUR_KERNEL),
+        'blur_sigma': BLUR_SIGMA,
+        'threshold': THRESHOLD,
+        'epsilon_factor': EPSILON_FACTOR,
+        'min_contour_area': MIN_CONTOUR_AREA,
+        'target_size': TARGET_SIZE,
+    }
+
+def cache_key(data, params):
+    """Khóa cache: SHA-256 của nội dung ảnh cộng với tham số tracing"""
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def cache_lookup(cache_dir, key, output_path):
+    """Nếu khóa có trong cache thì ghi PDF đã lưu ra output_path và trả về True"""
+    cached_path = os.path.join(cache_dir, key + '.pdf')
+    try:
+        shutil.copyfile(cached_path, output_path)
+    except FileNotFoundError:
+        return False
+    # Cập nhật thời gian truy cập để eviction theo LRU
+    os.utime(cached_path)
+    return True
+
+def cache_read(cache_dir, key):
+    """Nội dung PDF đã lưu trong cache, hoặc None nếu chưa có"""
+    cached_path = os.path.join(cache_dir, key + '.pdf')
+    try:
+        with open(cached_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    os.utime(cached_path)
+    return data
+
+def cache_write(cache_dir, key, data):
+    """Lưu nội dung PDF vào cache (ghi file tạm rồi rename)"""
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_path = os.path.join(cache_dir, key + '.pdf')
+    temp_path = f"{cached_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, cached_path)
+
+def cache_store(cache_dir, key, output_path):
+    """Lưu PDF vừa tạo vào cache (ghi file tạm rồi rename để tránh file dở dang)"""
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_path = os.path.join(cache_dir, key + '.pdf')
+    temp_path = f"{cached_path}.{os.getpid()}.tmp"
+    shutil.copyfile(output_path, temp_path)
+    os.replace(temp_path, cached_path)
+
+def prune_cache(cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """Xóa các mục dùng lâu nhất cho tới khi cache không vượt quá max_bytes, trả về số mục đã xóa"""
+    if not os.path.isdir(cache_dir):
+        return 0
+    
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith('.pdf'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    return evicted
+
+def shard_of(relative_path, count):
+    """
+    Shard (0..count-1) của một file theo SHA-1 của đường dẫn tương đối (dạng
+    '/'): không phụ thuộc máy, hệ điều hành hay thứ tự liệt kê thư mục
+    """
+    key = relative_path.replace(os.sep, '/').encode('utf-8')
+    return int.from_bytes(hashlib.sha1(key).digest()[:8], 'big') % count
+
+def file_digest(path):
+    """SHA-256 của nội dung file, đọc từng khối 1 MB"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_manifest(path):
+    """
+    Đọc manifest JSON lines, trả về danh sách bản ghi ([] nếu chưa có file).
+    Dòng ghi dở (process bị kill giữa chừng, có thể cắt giữa một ký tự
+    UTF-8) bị bỏ qua
+    """
+    records = []
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line.decode('utf-8')))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+class ManifestWriter:
+    """
+    Manifest chỉ ghi nối tiếp của một shard: mỗi bản ghi là một dòng JSON
+    được flush và fsync ngay, nên crash chỉ có thể làm mất dòng đang ghi dở
+    """
+    
+    def __init__(self, path, shard=None):
+        self.shard = f"{shard[0]}/{shard[1]}" if shard else None
+        self.host = socket.gethostname()
+        # Mở dạng bytes: dòng ghi dở có thể dừng giữa một ký tự UTF-8
+        self.file = open(path, 'ab+')
+        # Dòng cuối ghi dở của lần chạy trước: xuống dòng để không dính vào bản ghi mới
+        if self.file.tell():
+            self.file.seek(-1, os.SEEK_END)
+            if self.file.read(1) != b'\n':
+                self.file.write(b'\n')
+    
+    def append(self, record):
+        record = dict(record, shard=self.shard, host=self.host, time=time.time())
+        self.file.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+    
+    def begin(self, files, skipped):
+        """Bản ghi mở đầu mỗi lần chạy: số file của shard và số file bỏ qua vì đã xong"""
+        self.append({'type': 'run', 'files': files, 'skipped': skipped})
+    
+    def record(self, job, result):
+        """
+        Bản ghi của một ảnh: chữ ký của file input, file output, trạng thái,
+        thời gian. SHA-256 của input lấy từ result['input_sha256'] (tính ở
+        nơi đọc file, xem _convert_job)
+        """
+        entry = {'type': 'file', 'file': job['file'], 'output': result['output'],
+                 'status': 'error' if result['error'] else 'ok', 'error': result['error'],
+                 'cached': result['cached'], 'wall_ms': result.get('wall_ms'), 'budget': result.get('budget')}
+        try:
+            stat = os.stat(job['input'])
+            entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, input_sha256=result.get('input_sha256'))
+        except OSError:
+            pass
+        self.append(entry)
+    
+    def close(self):
+        self.file.close()
+
+def _is_done(record, input_path):
+    """
+    Ảnh đã xử lý xong theo bản ghi manifest: thành công, file output còn và
+    input không đổi (cùng size/mtime, hoặc cùng SHA-256 nếu mtime khác)
+    """
+    if record is None or record['status'] != 'ok' or not os.path.exists(record['output']):
+        return False
+    try:
+        stat = os.stat(input_path)
+    except OSError:
+        return False
+    if stat.st_size != record.get('size'):
+        return False
+    return stat.st_mtime_ns == record.get('mtime_ns') or file_digest(input_path) == record.get('input_sha256')
+
+def _record_results(results, jobs, manifest):
+    """Ghi manifest cho từng kết quả ngay khi nhận được, rồi chuyển tiếp kết quả"""
+    for job, result in zip(jobs, results):
+        manifest.record(job, result)
+        yield result
+
+def _init_worker(opencv_threads):
+    """
+    Khởi tạo mỗi process worker: import cv2 và fitz một lần ở đây để job đầu
+    tiên không phải chờ (svglib/reportlab được import ở job svg đầu tiên) và
+    giới hạn số thread nội bộ của OpenCV để không tranh CPU với các worker khác
+    """
+    import cv2
+    import fitz  # noqa: F401
+    cv2.setNumThreads(opencv_threads)
+
+def _make_job(input_dir, output_dir, image_file, backend, cache_dir, tile_size=None,
+              metrics=False, profile_dir=None, page_only=False,
+              optimizations=frozenset(), quantize_step=QUANTIZE_STEP, resolution='source',
+              simplify='opencv', levels=None, palette=False, render_budget=None, budget_policy='simplify'):
+    """
+    Mô tả công việc cho một file ảnh, gửi được sang process worker. Với
+    page_only, worker không ghi file mà trả trang PDF về trong result['page']
+    """
+    return {
+        'file': image_file,
+        'input': os.path.join(input_dir, image_file),
+        'output': None if page_only else os.path.join(output_dir, os.path.splitext(image_file)[0] + '.pdf'),
+        'output_dir': output_dir,
+        'backend': backend,
+        'cache_dir': cache_dir,
+        'tile_size': tile_size,
+        'metrics': metrics,
+        'profile_dir': profile_dir,
+        'optimizations': optimizations,
+        'quantize_step': quantize_step,
+        'resolution': resolution,
+        'simplify': simplify,
+        'levels': levels,
+        'palette': palette,
+        'render_budget': render_budget,
+        'budget_policy': budget_policy,
+    }
+
+def _job_params(job):
+    return trace_params(job['backend'], job['optimizations'], job['quantize_step'],
+                        job['resolution'], job['simplify'], job['levels'], job['palette'],
+                        job['render_budget'], job['budget_policy'])
+
+def _run_page_job(job, result):
+    """
+    Tạo trang PDF cho chế độ gộp nhiều ảnh vào một file: backend native chỉ
+    trả về content stream (hoặc polygon khi dedupe, để các trang dùng chung
+    XObject), backend svg và cache trả về PDF một trang
+    """
+    import fitz
+    optimizations = job['optimizations']
+    key = None
+    if job['cache_dir']:
+        with _stage('cache'):
+            with open(job['input'], 'rb') as f:
+                key = cache_key(f.read(), _job_params(job))
+            data = cache_read(job['cache_dir'], key)
+        if data is not None:
+            result['cached'] = True
+            result['page'] = {'pdf': data}
+            return
+    
+    if job['levels']:
+        *traced, epsilon = _trace_input(job['input'], job['tile_size'], job['resolution'], job['simplify'],
+                                        levels=job['levels'], palette=job['palette'])
+        plain, plain_matrix = layered_geometry(*traced, epsilon=epsilon)
+        geometry, matrix = plain, plain_matrix
+        if 'quantize' in optimizations:
+            geometry, matrix = quantize_layers(plain, plain_matrix, job['quantize_step'])
+        result['page'] = {'content': _layered_content(geometry, matrix)}
+        if optimizations:
+            with _stage_alone('bytes_before'):
+                result['bytes_before'] = _unoptimized_size(
+                    result['page']['content'] if matrix is plain_matrix else _layered_content(plain, plain_matrix))
+        if key is not None:
+            doc = fitz.open()
+            add_layered_page(doc, geometry, matrix)
+            data = doc.tobytes(deflate='compress' in optimizations)
+            doc.close()
+    elif job['backend'] == 'native':
+        *traced, epsilon = _trace_input(job['input'], job['tile_size'], job['resolution'], job['simplify'],
+                                        render_budget=job['render_budget'], budget_policy=job['budget_policy'])
+        if isinstance(traced[0], RasterFallback):
+            output = io.BytesIO()
+            result['bytes_before'] = raster_to_pdf(traced[0].mask, *traced[1:], output, optimizations)
+            data = output.getvalue()
+            result['page'] = {'pdf': data}
+        else:
+            plain, plain_matrix = page_geometry(*traced, epsilon=epsilon)
+            polygons, matrix = plain, plain_matrix
+            if 'quantize' in optimizations:
+                polygons, matrix = quantize_polygons(plain, plain_matrix, job['quantize_step'])
+            if 'dedupe' in optimizations:
+                result['page'] = {'polygons': polygons, 'matrix': matrix}
+            else:
+                result['page'] = {'content': _page_content(polygons, matrix)}
+            if optimizations:
+                with _stage_alone('bytes_before'):
+                    same = matrix is plain_matrix and 'content' in result['page']
+                    result['bytes_before'] = _unoptimized_size(
+                        result['page']['content'] if same else _page_content(plain, plain_matrix))
+            if key is not None:
+                doc = fitz.open()
+                add_polygon_page(doc, polygons, matrix, ShapeTable(doc) if 'dedupe' in optimizations else None)
+                data = doc.tobytes(deflate='compress' in optimizations)
+                doc.close()
+    else:
+        output = io.BytesIO()
+        result['bytes_before'] = convert_image(job['input'], output, job['backend'], job['tile_size'],
+                                               optimizations, job['quantize_step'], job['resolution'],
+                                               job['simplify'], levels=job['levels'], palette=job['palette'],
+                                               render_budget=job['render_budget'], budget_policy=job['budget_policy'])
+        data = output.getvalue()
+        result['page'] = {'pdf': data}
+    
+    if key is not None:
+        with _stage('cache'):
+            cache_write(job['cache_dir'], key, data)
+
+def _run_buffered_job(job, result):
+    """
+    Chuyển ảnh đã được stage đọc nạp sẵn (job['data']) và trả PDF trong
+    result['pdf'] để stage ghi lưu file; worker không đọc/ghi thư mục input/output
+    """
+    output = io.BytesIO()
+    result['bytes_before'] = convert_image(job['input'], output, job['backend'], job['tile_size'],
+                                           job['optimizations'], job['quantize_step'], job['resolution'],
+                                           job['simplify'], job['data'], job['levels'], job['palette'],
+                                           job['render_budget'], job['budget_policy'])
+    result['pdf'] = output.getvalue()
+
+def _run_job(job, result):
+    """Tra cache hoặc chuyển đổi một ảnh, cập nhật result['cached']"""
+    if job['output'] is None:
+        _run_page_job(job, result)
+        return
+    if 'data' in job:
+        _run_buffered_job(job, result)
+        return
+    
+    key = None
+    if job['cache_dir']:
+        with _stage('cache'):
+            with open(job['input'], 'rb') as f:
+                key = cache_key(f.read(), _job_params(job))
+            if cache_lookup(job['cache_dir'], key, job['output']):
+                result['cached'] = True
+                return
+    
+    result['bytes_before'] = convert_image(job['input'], job['output'], job['backend'], job['tile_size'],
+                                           job['optimizations'], job['quantize_step'], job['resolution'],
+                                           job['simplify'], levels=job['levels'], palette=job['palette'],
+                                           render_budget=job['render_budget'], budget_policy=job['budget_policy'])
+    
+    if key is not None:
+        with _stage('cache'):
+            cache_store(job['cache_dir'], key, job['output'])
+
+def _convert_job(job):
+    """Chạy convert_image cho một file, trả về kết quả thay vì ném lỗi"""
+    result = {'file': job['file'], 'output': job['output'], 'error': None, 'cached': False}
+    start = time.perf_counter()
+    profiler = None
+    if job['profile_dir']:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    
+    with contextlib.ExitStack() as stack:
+        if job['metrics'] or profiler:
+            result['metrics'] = stack.enter_context(collect_metrics(job['file']))
+        take_budget_log()
+        try:
+            _run_job(job, result)
+        except Exception as e:
+            result['error'] = str(e)
+        budget = take_budget_log()
+        if budget is not None:
+            result['budget'] = budget
+    
+    if profiler:
+        profiler.disable()
+        os.makedirs(job['profile_dir'], exist_ok=True)
+        result['profile'] = os.path.join(job['profile_dir'], job['file'] + '.prof')
+        profiler.dump_stats(result['profile'])
+    
+    if 'metrics' in result:
+        result['metrics']['status'] = 'error' if result['error'] else ('cached' if result['cached'] else 'ok')
+    if job.get('release_buffers'):
+        worker_buffer_pool().clear()
+    if job.get('manifest'):
+        result['wall_ms'] = (time.perf_counter() - start) * 1000
+        # Hash trong worker (song song, file vừa đọc còn trong page cache) thay vì trên thread ghi manifest
+        try:
+            result['input_sha256'] = (hashlib.sha256(job['data']).hexdigest() if 'data' in job
+                                      else file_digest(job['input']))
+        except OSError:
+            pass
+    return result
+
+def _keep_slowest_profiles(results, keep):
+    """Chỉ giữ file profile của `keep` ảnh chậm nhất, trả về danh sách đã giữ"""
+    profiled = sorted((r for r in results if r.get('profile')),
+                      key=lambda r: r['metrics']['wall_ms'], reverse=True)
+    for result in profiled[keep:]:
+        try:
+            os.remove(result['profile'])
+        except FileNotFoundError:
+            pass
+        result['profile'] = None
+    return profiled[:keep]
+
+def _failed_result(job, error):
+    """Kết quả lỗi cho job không có kết quả từ worker (worker chết giữa chừng)"""
+    result = {'file': job['file'], 'output': job['output'], 'error': error, 'cached': False}
+    if job['metrics']:
+        result['metrics'] = _error_metrics(job['file'])
+    return result
+
+def _convert_jobs(jobs):
+    """Chạy lần lượt một nhóm job trong worker (một lần gửi/nhận cho cả nhóm)"""
+    return [_convert_job(job) for job in jobs]
+
+class WorkerPool:
+    """
+    Process pool cho các job, tự tạo lại khi một worker chết (bị OOM kill,
+    crash trong thư viện C...). Pool hỏng làm mất kết quả của mọi job đang
+    chạy hoặc đang chờ trên nó: các job đó được chạy lại trên pool mới, job
+    nào làm pool hỏng thêm lần nữa thì chạy một mình (run_isolated), nên chỉ
+    ảnh thực sự làm worker chết bị ghi lỗi
+    """
+    
+    def __init__(self, workers, opencv_threads):
+        self.workers = workers
+        self.opencv_threads = opencv_threads
+        self.generation = 0  # Tăng mỗi lần tạo lại pool
+        self.lock = threading.Lock()
+        self.executor = self._create(workers)
+    
+    def _create(self, workers):
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self.opencv_threads,))
+    
+    def restart(self, generation):
+        """Thay pool thế hệ `generation` đã hỏng bằng pool mới (bỏ qua nếu đã thay rồi)"""
+        with self.lock:
+            if generation == self.generation:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self._create(self.workers)
+                self.generation += 1
+    
+    def submit(self, jobs):
+        """Giao một nhóm job, trả về future của danh sách kết quả (future.generation là thế hệ pool)"""
+        while True:
+            with self.lock:
+                generation = self.generation
+                try:
+                    future = self.executor.submit(_convert_jobs, jobs)
+                except BrokenProcessPool:
+                    future = None
+                if future is not None:
+                    future.generation = generation
+                    return future
+            self.restart(generation)
+    
+    def result(self, future, jobs):
+        """Danh sách kết quả của future từ submit(jobs); pool hỏng thì chạy lại các job như mô tả ở trên"""
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self.restart(future.generation)
+        retries = [self.submit([job]) for job in jobs]
+        results = []
+        for job, retry in zip(jobs, retries):
+            try:
+                results.extend(retry.result())
+            except BrokenProcessPool:
+                self.restart(retry.generation)
+                results.append(self.run_isolated(job))
+        return results
+    
+    def run_isolated(self, job):
+        """Chạy một job một mình trên một worker riêng; worker chết thì trả về kết quả lỗi"""
+        executor = self._create(1)
+        try:
+            return executor.submit(_convert_job, job).result()
+        except BrokenProcessPool:
+            return _failed_result(job, "Worker bị dừng đột ngột khi xử lý ảnh (hết bộ nhớ hoặc crash)")
+        finally:
+            executor.shutdown()
+    
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+def _iter_results(jobs, workers, chunksize, opencv_threads):
+    """
+    Chạy các job (tuần tự hoặc trên process pool), trả kết quả lần lượt theo
+    thứ tự input. Worker chết chỉ làm lỗi ảnh gây ra nó (xem WorkerPool)
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = min(workers or cpu_count, max(len(jobs), 1))
+    if opencv_threads is None:
+        opencv_threads = max(1, cpu_count // workers)
+    
+    if workers <= 1:
+        _init_worker(opencv_threads)
+        for job in jobs:
+            yield _convert_job(job)
+        return
+    
+    if chunksize is None:
+        # Chia nhỏ để cân tải nhưng vẫn giảm chi phí gửi/nhận giữa các process
+        chunksize = max(1, len(jobs) // (workers * 4))
+    pool = WorkerPool(workers, opencv_threads)
+    try:
+        # Chỉ giữ 2 * workers nhóm trên pool, trả kết quả theo thứ tự giao
+        window = collections.deque()
+        for start in range(0, len(jobs), chunksize):
+            chunk = jobs[start:start + chunksize]
+            window.append((pool.submit(chunk), chunk))
+            if len(window) >= 2 * workers:
+                yield from pool.result(*window.popleft())
+        while window:
+            yield from pool.result(*window.popleft())
+    finally:
+        pool.shutdown()
+
+def estimate_working_set(header, file_size=0, tile_size=None, levels=None, palette=False):
+    """
+    Ước lượng bộ nhớ (bytes) để xử lý một ảnh chỉ từ header của nó: file
+    đã đọc, ảnh đã giải mã, bộ đệm kênh xám/blur của preprocess_image, bản
+    sao của findContours, ảnh nhãn/mask của chế độ nhiều lớp và phần dành
+    cho contours (CONTOUR_BYTES_PER_PIXEL)
+    
+    Args:
+        header (dict): Kết quả read_image_header
+        tile_size (int): Với xử lý theo dải, các bộ đệm chỉ cao tile_size hàng
+    """
+    width, height = header['width'], header['height']
+    pixels = width * height
+    channels = header['channels']
+    decoded = pixels * channels * (2 if header['bit_depth'] > 8 else 1)
+    
+    # Blur và bản sao của findContours, thêm kênh xám khi ảnh nhiều kênh
+    per_pixel = 2 + (channels > 1)
+    if tile_size and height > tile_size:
+        # Mỗi dải còn có ảnh normalize và ảnh nhị phân
+        buffers = width * tile_size * (per_pixel + 2)
+    else:
+        if levels:
+            # Ảnh nhãn và mask; palette thêm khoảng cách float32 và nhãn tạm của từng pixel
+            per_pixel += 14 if palette else 2
+        buffers = pixels * per_pixel
+    return file_size + decoded + buffers + pixels * CONTOUR_BYTES_PER_PIXEL
+
+def _job_working_set(job):
+    """estimate_working_set của một job, 0 nếu không đọc được header (job sẽ tự báo lỗi)"""
+    try:
+        header = read_image_header_file(job['input'])
+        file_size = os.path.getsize(job['input'])
+    except (OSError, ValueError):
+        return 0
+    return estimate_working_set(header, file_size, job['tile_size'], job['levels'], job['palette'])
+
+def _iter_budgeted_results(jobs, workers, opencv_threads, memory_budget):
+    """
+    Như _iter_results nhưng chỉ giao job cho worker khi tổng RSS ước lượng
+    (WORKER_BASE_BYTES mỗi worker cộng estimate_working_set của các ảnh
+    đang xử lý) không vượt memory_budget. Job được xét từ lớn tới nhỏ, lấy
+    job lớn nhất còn vừa: ảnh lớn chạy trước, ảnh nhỏ lấp chỗ trống còn lại.
+    Ảnh lớn hơn cả ngân sách chạy một mình. Ảnh lớn hơn phần chia đều cho
+    mỗi worker được trả lại bộ đệm (BufferPool) ngay sau khi xử lý
+    
+    Yields:
+        dict: Kết quả theo đúng thứ tự input
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = min(workers or cpu_count, max(len(jobs), 1))
+    # Mỗi worker cần ít nhất chừng ấy bộ nhớ nữa cho ảnh
+    workers = max(1, min(workers, memory_budget // (2 * WORKER_BASE_BYTES)))
+    if opencv_threads is None:
+        opencv_threads = max(1, cpu_count // workers)
+    
+    available = memory_budget - workers * WORKER_BASE_BYTES
+    sizes = [_job_working_set(job) for job in jobs]
+    for job, size in zip(jobs, sizes):
+        if size > available / workers:
+            job['release_buffers'] = True
+    
+    if workers <= 1:
+        yield from _iter_results(jobs, 1, None, opencv_threads)
+        return
+    
+    # Job chưa chạy theo kích thước giảm dần; keys (= -kích thước) để tìm nhị phân
+    # job lớn nhất còn vừa phần bộ nhớ còn lại
+    pending = sorted(range(len(jobs)), key=lambda index: -sizes[index])
+    keys = [-sizes[index] for index in pending]
+    running = {}  # future -> chỉ số job
+    used = 0
+    finished = {}
+    next_index = 0
+    pool = WorkerPool(workers, opencv_threads)
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                position = bisect.bisect_left(keys, used - available)
+                if position == len(pending):
+                    if running:
+                        break
+                    position = 0  # Lớn hơn cả ngân sách: chạy một mình
+                index = pending.pop(position)
+                keys.pop(position)
+                running[pool.submit([jobs[index]])] = index
+                used += sizes[index]
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                used -= sizes[index]
+                # Pool hỏng: các job đang chạy khác cũng lần lượt tới đây và được chạy lại
+                finished[index] = pool.result(future, [jobs[index]])[0]
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+    finally:
+        pool.shutdown()
+
+class QueueStats:
+    """
+    Độ sâu của một hàng đợi trong pipeline (lấy mẫu mỗi lần đưa vào), thời
+    gian stage phía trước bị chặn vì hàng đợi đầy và thời gian stage phía
+    sau phải chờ vì hàng đợi rỗng
+    """
+    
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.blocked_s = 0.0
+        self.starved_s = 0.0
+        self.lock = threading.Lock()
+    
+    def sample(self, depth, blocked=0.0):
+        with self.lock:
+            self.samples += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+            self.blocked_s += blocked
+    
+    def starve(self, seconds):
+        with self.lock:
+            self.starved_s += seconds
+    
+    def summary(self):
+        mean = self.depth_total / self.samples if self.samples else 0.0
+        return {
+            'capacity': self.capacity,
+            'mean_depth': mean,
+            'max_depth': self.max_depth,
+            'fill': mean / self.capacity if self.capacity else 0.0,
+            'blocked_s': self.blocked_s,
+            'starved_s': self.starved_s,
+        }
+
+def _timed_put(q, item, stats):
+    start = time.perf_counter()
+    q.put(item)
+    stats.sample(q.qsize(), blocked=time.perf_counter() - start)
+
+def _timed_get(q, stats):
+    start = time.perf_counter()
+    item = q.get()
+    stats.starve(time.perf_counter() - start)
+    return item
+
+def _write_atomic(path, data):
+    """Ghi ra file tạm cùng thư mục rồi rename, không bao giờ để lại PDF ghi dở"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _pipeline_reader(jobs, read_queue, write_queue, stats):
+    """
+    Stage đọc: nạp trước nội dung từng ảnh vào hàng đợi có giới hạn, tra
+    cache ngay tại đây (ảnh có trong cache đi thẳng tới stage ghi)
+    """
+    try:
+        for index, job in enumerate(jobs):
+            result = {'file': job['file'], 'output': job['output'], 'error': None, 'cached': False}
+            start = time.perf_counter()
+            try:
+                with open(job['input'], 'rb') as f:
+                    data = f.read()
+                key = cache_key(data, _job_params(job)) if job['cache_dir'] else None
+                cached = cache_read(job['cache_dir'], key) if key else None
+            except Exception as e:
+                result['error'] = str(e)
+                if job['metrics']:
+                    result['metrics'] = _error_metrics(job['file'], (time.perf_counter() - start) * 1000)
+                _timed_put(write_queue, (index, result, None, None), stats['write'])
+                continue
+            read_ms = (time.perf_counter() - start) * 1000
+            
+            if cached is not None:
+                result['cached'] = True
+                if job.get('manifest'):
+                    result['input_sha256'] = hashlib.sha256(data).hexdigest()
+                if job['metrics']:
+                    result['metrics'] = {'file': job['file'], 'wall_ms': read_ms, 'cpu_ms': 0.0,
+                                         'stages': {'read': {'wall_ms': read_ms, 'cpu_ms': 0.0}},
+                                         'counts': {}, 'status': 'cached'}
+                _timed_put(write_queue, (index, result, cached, None), stats['write'])
+            else:
+                _timed_put(read_queue, (index, dict(job, data=data), key, read_ms), stats['read'])
+    finally:
+        read_queue.put(None)
+
+def _pipeline_writer(write_queue, results, cache_dir, stats, on_result=None):
+    """
+    Stage ghi: lưu PDF (ghi file tạm rồi rename) và ghi cache, theo thứ tự
+    hoàn thành; gọi on_result(index, result) sau mỗi file
+    """
+    while True:
+        item = _timed_get(write_queue, stats['write'])
+        if item is None:
+            break
+        index, result, data, key = item
+        if result['error'] is None:
+            start = time.perf_counter()
+            try:
+                _write_atomic(result['output'], data)
+                if key is not None:
+                    cache_write(cache_dir, key, data)
+            except OSError as e:
+                result['error'] = str(e)
+            if 'metrics' in result:
+                write_ms = (time.perf_counter() - start) * 1000
+                stage = result['metrics']['stages'].setdefault('write', {'wall_ms': 0.0, 'cpu_ms': 0.0})
+                stage['wall_ms'] += write_ms
+                result['metrics']['wall_ms'] += write_ms
+        results[index] = result
+        if on_result is not None:
+            on_result(index, result)
+
+def pipeline_bottleneck(stats):
+    """
+    Stage chậm nhất theo thời gian chờ: stage trước bị chặn vì hàng đợi đầy
+    nghĩa là stage sau chậm, stage tính toán phải chờ ảnh nghĩa là stage đọc chậm
+    """
+    waits = {
+        'read': stats['read']['starved_s'],
+        'compute': stats['read']['blocked_s'] + stats['compute']['blocked_s'],
+        'write': stats['write']['blocked_s'],
+    }
+    return max(waits, key=waits.get)
+
+def run_pipeline(jobs, workers=None, opencv_threads=None, queue_size=None, manifest=None):
+    """
+    Chạy các job theo ba stage chồng lên nhau: một thread đọc nạp trước ảnh,
+    pool process tính toán (giải mã, trace, tạo PDF trong bộ nhớ) và một
+    thread ghi file. Các hàng đợi giữa các stage có giới hạn nên bộ nhớ không
+    tăng khi một stage chậm hơn các stage khác
+    
+    Args:
+        jobs (list): Job từ _make_job (mỗi ảnh một PDF)
+        queue_size (int): Sức chứa mỗi hàng đợi (mặc định: 2 * workers)
+        manifest (ManifestWriter): Ghi bản ghi của mỗi ảnh ngay khi stage ghi xong
+    
+    Returns:
+        tuple: (kết quả theo thứ tự input, {'read', 'compute', 'write': QueueStats.summary()})
+            'read' là hàng đợi đọc -> tính toán, 'compute' là số ảnh đang tính,
+            'write' là hàng đợi tính toán -> ghi
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = workers or cpu_count
+    if opencv_threads is None:
+        opencv_threads = max(1, cpu_count // workers)
+    queue_size = queue_size or 2 * workers
+    
+    stats = {'read': QueueStats(queue_size), 'compute': QueueStats(workers), 'write': QueueStats(queue_size)}
+    read_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    results = [None] * len(jobs)
+    cache_dir = jobs[0]['cache_dir'] if jobs else None
+    
+    reader = threading.Thread(target=_pipeline_reader, args=(jobs, read_queue, write_queue, stats), daemon=True)
+    on_result = None
+    if manifest is not None:
+        def on_result(index, result):
+            manifest.record(jobs[index], result)
+    writer = threading.Thread(target=_pipeline_writer, args=(write_queue, results, cache_dir, stats, on_result),
+                              daemon=True)
+    # Giao cho pool tối đa `workers` ảnh một lúc để backpressure lan về stage đọc
+    in_flight = threading.BoundedSemaphore(workers)
+    active = [0]
+    active_lock = threading.Lock()
+    # Job mất kết quả vì pool hỏng, chạy lại sau khi các job còn lại xong (xem WorkerPool)
+    lost = []
+    
+    def finish(index, result, key, read_ms):
+        data = result.pop('pdf', None)
+        if 'metrics' in result:
+            result['metrics']['stages']['read'] = {'wall_ms': read_ms, 'cpu_ms': 0.0}
+            result['metrics']['wall_ms'] += read_ms
+        _timed_put(write_queue, (index, result, data, key if result['error'] is None else None), stats['write'])
+    
+    def done(future, index, job, key, read_ms):
+        try:
+            result = future.result()[0]
+        except BrokenProcessPool:  # Worker chết: tạo lại pool, chạy lại job sau
+            pool.restart(future.generation)
+            lost.append((index, job, key, read_ms))
+            result = None
+        except Exception as e:
+            result = _failed_result(job, str(e))
+        with active_lock:
+            active[0] -= 1
+        in_flight.release()
+        if result is not None:
+            finish(index, result, key, read_ms)
+    
+    reader.start()
+    writer.start()
+    pool = WorkerPool(workers, opencv_threads)
+    try:
+        while True:
+            item = _timed_get(read_queue, stats['read'])
+            if item is None:
+                break
+            index, job, key, read_ms = item
+            start = time.perf_counter()
+            in_flight.acquire()
+            with active_lock:
+                active[0] += 1
+                depth = active[0]
+            stats['compute'].sample(depth, blocked=time.perf_counter() - start)
+            future = pool.submit([job])
+            future.add_done_callback(
+                lambda f, index=index, job=job, key=key, read_ms=read_ms: done(f, index, job, key, read_ms))
+            del job, item
+        reader.join()
+        # Chờ mọi job đang chạy xong (done đã ghi nhận các job bị mất)
+        for _ in range(workers):
+            in_flight.acquire()
+        retries = [(pool.submit([job]), index, job, key, read_ms) for index, job, key, read_ms in lost]
+        for future, index, job, key, read_ms in retries:
+            finish(index, pool.result(future, [job])[0], key, read_ms)
+    finally:
+        pool.shutdown()
+        write_queue.put(None)
+        writer.join()
+    
+    return results, {name: entry.summary() for name, entry in stats.items()}
+
+def _add_result_page(doc, page, shape_table=None):
+    """Thêm trang do worker trả về (content stream, polygon hoặc PDF một trang) vào doc"""
+    import fitz
+    if 'polygons' in page:
+        add_polygon_page(doc, page['polygons'], page['matrix'], shape_table)
+    elif 'content' in page:
+        add_content_page(doc, page['content'])
+    else:
+        src = fitz.open(stream=page['pdf'], filetype='pdf')
+        try:
+            doc.insert_pdf(src)
+        finally:
+            src.close()
+
+def write_combined_pdfs(results, output_dir, pages_per_file=0, name='combined', optimizations=frozenset()):
+    """
+    Gộp các trang do worker trả về thành PDF nhiều trang và ghi file index
+    
+    Args:
+        results (iterable): Kết quả theo thứ tự input, có result['page']
+        pages_per_file (int): Số trang mỗi file (0 = tất cả trong một file)
+        name (str): Tên file: {name}.pdf, hoặc {name}_0001.pdf... khi chia nhiều file
+        optimizations (frozenset): 'dedupe' dùng chung XObject giữa các trang
+            trong cùng file, 'compress' nén các stream
+    
+    Returns:
+        list: Kết quả, mỗi ảnh thành công có thêm 'output' và 'page' (bắt đầu từ 1)
+    """
+    import fitz
+    collected = []
+    index = {}
+    doc = None
+    part = 0
+    
+    def save(doc):
+        if pages_per_file:
+            path = os.path.join(output_dir, f"{name}_{part:04d}.pdf")
+        else:
+            path = os.path.join(output_dir, f"{name}.pdf")
+        with _stage('write'):
+            # garbage=3 gộp các object trùng nhau (font, resource) giữa các trang
+            doc.save(path, garbage=3, deflate='compress' in optimizations)
+        doc.close()
+        return path
+    
+    pending = []
+    for result in results:
+        collected.append(result)
+        page = result.pop('page', None)
+        if result['error'] is not None:
+            continue
+        if doc is None:
+            doc = fitz.open()
+            shape_table = ShapeTable(doc) if 'dedupe' in optimizations else None
+            part += 1
+        _add_result_page(doc, page, shape_table)
+        result['page'] = len(doc)
+        pending.append(result)
+        if pages_per_file and len(doc) >= pages_per_file:
+            path = save(doc)
+            doc = None
+            for done in pending:
+                done['output'] = path
+            pending = []
+    
+    if doc is not None:
+        path = save(doc)
+        for done in pending:
+            done['output'] = path
+    
+    for result in collected:
+        if result['error'] is None:
+            index[result['file']] = {'output': os.path.basename(result['output']), 'page': result['page']}
+    with open(os.path.join(output_dir, f"{name}_index.json"), 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    
+    return collected
+
+def _print_savings(results):
+    """
+    In dung lượng trước/sau tối ưu của từng file đầu ra. Với file gộp nhiều
+    trang, "trước" là tổng dung lượng PDF một trang chưa tối ưu của các ảnh,
+    nên phần giảm gồm cả phần tiết kiệm do gộp trang (in kèm nhãn riêng)
+    """
+    totals = {}
+    for result in results:
+        if result['error'] is not None:
+            continue
+        total = totals.setdefault(result['output'], [0, True, 0])
+        total[2] += 1
+        if result.get('bytes_before') is None:
+            total[1] = False  # ảnh lấy từ cache, không biết dung lượng trước
+        else:
+            total[0] += result['bytes_before']
+    
+    print("Dung lượng sau tối ưu:")
+    for output, (before, known, pages) in totals.items():
+        after = os.path.getsize(output)
+        if not known or not before:
+            print(f"  {os.path.basename(output)}: {after:,} bytes")
+        elif pages > 1:
+            print(f"  {os.path.basename(output)}: {pages} PDF một trang chưa tối ưu {before:,} -> {after:,} bytes "
+                  f"({(after - before) / before:+.1%}, gồm cả phần giảm do gộp trang)")
+        else:
+            print(f"  {os.path.basename(output)}: {before:,} -> {after:,} bytes ({(after - before) / before:+.1%})")
+
+def check_options(backend='native', resolution='source', simplify='opencv', levels=None, tile_size=None,
+                  render_budget=None, budget_policy='simplify'):
+    """Báo ValueError nếu backend, resolution, simplify, levels hoặc ngân sách vẽ không hợp lệ"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chọn một trong {BACKENDS})")
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Độ phân giải không hợp lệ: {resolution} (chọn một trong {RESOLUTIONS})")
+    if simplify not in SIMPLIFY_METHODS:
+        raise ValueError(f"Cách đơn giản hóa không hợp lệ: {simplify} (chọn một trong {SIMPLIFY_METHODS})")
+    if levels is not None:
+        if not 2 <= levels <= MAX_LEVELS:
+            raise ValueError(f"Số lớp không hợp lệ: {levels} (từ 2 tới {MAX_LEVELS})")
+        if backend != 'native' or resolution != 'source' or tile_size:
+            raise ValueError("Chế độ nhiều lớp chỉ dùng backend 'native', resolution 'source' và không chia dải")
+    if budget_policy not in BUDGET_POLICIES:
+        raise ValueError(f"Chính sách ngân sách không hợp lệ: {budget_policy} (chọn một trong {BUDGET_POLICIES})")
+    if resolve_render_budget(render_budget) and levels is not None:
+        raise ValueError("Ngân sách vẽ chưa dùng được với chế độ nhiều lớp")
+
+def image_to_pdf(input_dir, output_dir, backend='native', workers=None, chunksize=None, opencv_threads=None,
+                 cache_dir=None, cache_max_bytes=CACHE_MAX_BYTES, tile_size=None,
+                 metrics_sink=None, profile_dir=None, profile_top=10,
+                 pages_per_file=None, combined_name='combined', optimize=None, quantize_step=QUANTIZE_STEP,
+                 resolution='source', simplify='opencv', pipeline=False, queue_size=None,
+                 levels=None, palette=False, memory_budget=None, shard=None, manifest=None,
+                 render_budget=None, budget_policy='simplify'):
+    """
+    Chuyển tất cả ảnh PNG/JPG trong input_dir thành PDF trong output_dir
+    
+    Args:
+        workers (int): Số process song song (mặc định: số CPU, 1 = chạy tuần tự)
+        chunksize (int): Số file giao cho worker mỗi lần (mặc định: tự tính)
+        opencv_threads (int): Số thread OpenCV trong mỗi worker
+            (mặc định: chia đều số CPU cho các worker)
+        cache_dir (str): Thư mục cache theo nội dung ảnh + tham số tracing
+            (mặc định: không dùng cache)
+        cache_max_bytes (int): Dung lượng tối đa của cache, vượt quá thì xóa
+            các mục dùng lâu nhất (LRU)
+        tile_size (int): Xử lý ảnh lớn theo từng dải cao tile_size pixel để
+            giảm bộ nhớ (mặc định: xử lý cả ảnh một lần)
+        metrics_sink (str | callable): File JSON lines hoặc hàm nhận dict metrics
+            (thời gian từng bước, số contour/điểm) của mỗi ảnh
+        profile_dir (str): Bật cProfile và lưu profile của profile_top ảnh chậm nhất
+        pages_per_file (int): Gộp nhiều ảnh vào PDF nhiều trang, mỗi file tối đa
+            pages_per_file trang (0 = một file duy nhất), kèm {combined_name}_index.json
+            ánh xạ tên ảnh -> file và số trang (mặc định: mỗi ảnh một PDF)
+        optimize (bool | iterable): Tối ưu dung lượng PDF, True = tất cả hoặc
+            danh sách trong OPTIMIZATIONS; in số bytes tiết kiệm được cho mỗi file
+        quantize_step (float): Bước lưới tọa độ (points) khi dùng 'quantize'
+        resolution (str): 'output' trace ở độ phân giải đầu ra (OUTPUT_DPI) với
+            sai số TOLERANCE_PT, ít điểm hơn nhiều với ảnh lớn; ảnh không qua
+            quality guard được trace lại ở độ phân giải gốc (mặc định 'source')
+        simplify (str): 'dp' hoặc 'vw' đơn giản hóa cả tập contour với sai số
+            TOLERANCE_PT và bỏ hình nhỏ hơn MIN_FEATURE_PT (mặc định 'opencv')
+        pipeline (bool): Đọc, tính toán và ghi file chồng lên nhau (run_pipeline),
+            in độ sâu các hàng đợi để thấy stage nào chậm nhất; chỉ dùng khi
+            mỗi ảnh một PDF
+        queue_size (int): Sức chứa mỗi hàng đợi của pipeline (mặc định: 2 * workers)
+        levels (int): Trace thành `levels` mức xám (trace_layers), vẽ các lớp
+            khác nền chồng lên nhau trên cùng một trang (mặc định: một lớp đen)
+        palette (bool): Với levels, chia theo bảng màu k-means thay vì mức xám
+        memory_budget (int): Tổng RSS tối đa (bytes) của các worker: kích thước
+            ảnh được đọc từ header để ước lượng bộ nhớ, chỉ chạy song song
+            các ảnh còn vừa ngân sách (xem _iter_budgeted_results)
+        shard (tuple): (i, N) chỉ xử lý các ảnh có shard_of(tên file, N) == i,
+            để chia một thư mục cho N máy
+        manifest (str): File JSON lines ghi nối tiếp kết quả từng ảnh (hash
+            input, file output, trạng thái, thời gian); khi chạy lại, các ảnh
+            đã xong và không đổi được bỏ qua. Chỉ dùng khi mỗi ảnh một PDF
+        render_budget (bool | dict): Giới hạn số contour, số điểm và bytes của
+            mỗi trang, True = RENDER_BUDGET hoặc dict ghi đè một số giới hạn
+        budget_policy (str): Cách xử lý ảnh vượt ngân sách, 'simplify' hoặc
+            'raster' (xem BUDGET_POLICIES); chính sách đã dùng được in ra và
+            lưu trong result['budget']
+    
+    Returns:
+        list: Kết quả của từng file theo đúng thứ tự input,
+            mỗi phần tử là dict {'file', 'output', 'error', 'cached'}
+            (thêm 'metrics' khi ghi metrics hoặc profile, 'bytes_before' khi tối ưu,
+            'budget' khi vượt ngân sách vẽ)
+    """
+    check_options(backend, resolution, simplify, levels, tile_size, render_budget, budget_policy)
+    render_budget = resolve_render_budget(render_budget)
+    if pipeline and pages_per_file is not None:
+        raise ValueError("pipeline chỉ dùng được khi mỗi ảnh ghi ra một PDF (pages_per_file=None)")
+    if pipeline and memory_budget:
+        raise ValueError("memory_budget không dùng được với pipeline")
+    if manifest and pages_per_file is not None:
+        raise ValueError("manifest chỉ dùng được khi mỗi ảnh ghi ra một PDF (pages_per_file=None)")
+    if shard is not None and not 0 <= shard[0] < shard[1]:
+        raise ValueError(f"Shard không hợp lệ: {shard[0]}/{shard[1]}")
+    optimizations = resolve_optimizations(optimize)
+    
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
     # Hỗ trợ cả file PNG và JPG
-    image_files = [f for f in os.listdir(input_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    temp_files = []  # Danh sách để lưu các file tạm thời
+    image_files = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if shard is not None:
+        image_files = [f for f in image_files if shard_of(f, shard[1]) == shard[0]]
+    
+    writer = None
+    if manifest:
+        done = {record['file']: record for record in read_manifest(manifest) if record.get('type') == 'file'}
+        remaining = [f for f in image_files if not _is_done(done.get(f), os.path.join(input_dir, f))]
+        if len(remaining) < len(image_files):
+            print(f"Manifest: bỏ qua {len(image_files) - len(remaining)} file đã xong")
+        writer = ManifestWriter(manifest, shard)
+        writer.begin(len(image_files), len(image_files) - len(remaining))
+        image_files = remaining
     
+    jobs = [
+        _make_job(input_dir, output_dir, image_file, backend, cache_dir, tile_size,
+                  metrics_sink is not None, profile_dir, pages_per_file is not None,
+                  optimizations, quantize_step, resolution, simplify, levels, palette,
+                  render_budget, budget_policy)
+        for image_file in image_files
+    ]
+    if writer is not None:
+        for job in jobs:
+            job['manifest'] = True
+    
+    pipeline_stats = None
     try:
-        for image_file in image_files:
+        if pipeline:
+            results, pipeline_stats = run_pipeline(jobs, workers, opencv_threads, queue_size, writer)
+        else:
+            if memory_budget:
+                job_results = _iter_budgeted_results(jobs, workers, opencv_threads, memory_budget)
+            else:
+                job_results = _iter_results(jobs, workers, chunksize, opencv_threads)
+            if writer is not None:
+                job_results = _record_results(job_results, jobs, writer)
+            if pages_per_file is None:
+                results = list(job_results)
+            else:
+                results = write_combined_pdfs(job_results, output_dir, pages_per_file, combined_name, optimizations)
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    for result in results:
+        if result['error'] is None:
+            page = f" (trang {result['page']})" if 'page' in result else ""
+            print(f"Đã chuyển đổi {result['file']} thành {os.path.basename(result['output'])}{page}")
+            if 'budget' in result:
+                budget = result['budget']
+                print(f"  vượt ngân sách vẽ ({', '.join(budget['exceeded'])}: {budget['contours']:,} contour, "
+                      f"{budget['vertices']:,} điểm), dùng '{budget['policy']}'")
+        else:
+            print(f"Lỗi khi xử lý {result['file']}: {result['error']}")
+    
+    if optimizations:
+        _print_savings(results)
+    
+    if pipeline_stats is not None:
+        names = {'read': 'đọc -> tính', 'compute': 'đang tính', 'write': 'tính -> ghi'}
+        print(f"Pipeline (chậm nhất: {pipeline_bottleneck(pipeline_stats)}):")
+        for stage, entry in pipeline_stats.items():
+            print(f"  {names[stage]}: trung bình {entry['mean_depth']:.1f}/{entry['capacity']}, "
+                  f"tối đa {entry['max_depth']}, bị chặn {entry['blocked_s']:.2f}s, chờ {entry['starved_s']:.2f}s")
+    
+    sink = make_metrics_sink(metrics_sink)
+    if sink is not None:
+        try:
+            for result in results:
+                sink(result['metrics'])
+        finally:
+            if sink is not metrics_sink:
+                sink.close()
+    
+    if profile_dir:
+        print(f"\nProfile của {min(profile_top, len(results))} ảnh chậm nhất (trong {profile_dir}):")
+        for result in _keep_slowest_profiles(results, profile_top):
+            print(f"  {result['file']}: {result['metrics']['wall_ms']:.1f} ms")
+    
+    if cache_dir:
+        hits = sum(1 for result in results if result['cached'])
+        misses = sum(1 for result in results if not result['cached'] and result['error'] is None)
+        evicted = prune_cache(cache_dir, cache_max_bytes)
+        print(f"Cache: {hits} hit, {misses} miss, đã xóa {evicted} mục cũ")
+    
+    return results
+
+def _scan_images(input_dir):
+    """Trả về {tên file: (mtime_ns, size)} của các ảnh đang có trong thư mục"""
+    images = {}
+    for entry in os.scandir(input_dir):
+        if entry.name.lower().endswith(IMAGE_EXTENSIONS):
             try:
-                input_path = os.path.join(input_dir, image_file)
-                output_filename = os.path.splitext(image_file)[0] + '.pdf'
-                temp_pdf_path = os.path.join(output_dir, f"temp_{output_filename}")  # Thêm đường dẫn file tạm
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # Đọc ảnh và lấy DPI
-                img = Image.open(input_path)
-                dpi_x, dpi_y = img.info.get('dpi', (96, 96))  # Mặc định 96 DPI nếu không có thông tin
-                img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
-                
-                if img is None:
-                    print(f"Không thể đọc file {image_file}")
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.is_file():
+                images[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return images
+
+def _watch_scanner(input_dir, output_dir, job_options, job_queue, stop_event,
+                   poll_interval, settle_time, process_existing):
+    """
+    Quét thư mục định kỳ, đưa các ảnh mới/đã sửa vào hàng đợi. Một file chỉ
+    được đưa vào khi kích thước và mtime không đổi trong settle_time giây
+    (tránh đọc file đang ghi dở). Khi hàng đợi đầy thì chờ (backpressure).
+    job_options là các tham số keyword của _make_job
+    """
+    # Chữ ký (mtime, size) của các file đã được đưa vào hàng đợi
+    done = {} if process_existing else _scan_images(input_dir)
+    # Các file đang chờ ổn định: tên -> (chữ ký, thời điểm thấy chữ ký đó)
+    pending = {}
+    
+    while not stop_event.is_set():
+        now = time.monotonic()
+        current = _scan_images(input_dir)
+        
+        for image_file, signature in sorted(current.items()):
+            if done.get(image_file) == signature:
+                continue
+            seen = pending.get(image_file)
+            if seen is None or seen[0] != signature:
+                pending[image_file] = (signature, now)
+                continue
+            if now - seen[1] < settle_time:
+                continue
+            
+            del pending[image_file]
+            job = _make_job(input_dir, output_dir, image_file, **job_options)
+            job['queued_at'] = time.monotonic()
+            while not stop_event.is_set():
+                try:
+                    job_queue.put(job, timeout=poll_interval)
+                    done[image_file] = signature
+                    break
+                except queue.Full:
                     continue
-                
-                # Tính kích thước thực tế (inch)
-                height, width = img.shape[:2]
-                width_inch = width / dpi_x
-                height_inch = height / dpi_y
-                
-                # Chuyển đổi inch sang points (1 inch = 72 points)
-                width_pt = width_inch * 72
-                height_pt = height_inch * 72
-                
-                # Xử lý ảnh
-                processed = preprocess_image(img)
-                
-                # Tìm contours
-                contours, _ = cv2.findContours(
-                    processed,
-                    cv2.RETR_EXTERNAL,
-                    cv2.CHAIN_APPROX_TC89_KCOS
-                )
-                
-                # Lọc contours
-                contours = [cnt for cnt in contours if cv2.contourArea(cnt) > 10]
-                
-                # Tạo SVG với kích thước thực
-                svg = Element('svg', {
-                    'xmlns': 'http://www.w3.org/2000/svg',
-                    'width': f'{width_pt}pt',
-                    'height': f'{height_pt}pt',
-                    'viewBox': f'0 0 {width} {height}',
-                    'preserveAspectRatio': 'none'
-                })
-                
-                g = SubElement(svg, 'g', {
-                    'fill': 'black',
-                    'stroke': 'none'
-                })
-                
-                path_data = create_svg_path_from_contours(contours)
-                if path_data:
-                    path_element = SubElement(g, 'path', {
-                        'd': path_data,
-                        'style': 'fill-rule:evenodd'
-                    })
-                
-                # Tạo file SVG tạm thời
-                with tempfile.NamedTemporaryFile(suffix='.svg', delete=False) as tmp_svg:
-                    temp_path = tmp_svg.name
-                    temp_files.append((tmp_svg, temp_path))
-                    tree = ElementTree(svg)
-                    tree.write(temp_path, encoding='utf-8', xml_declaration=True)
-                
-                # Chuyển SVG sang PDF tạm thời
-                drawing = svg2rlg(temp_path)
-                renderPDF.drawToFile(drawing, temp_pdf_path)  # Lưu vào file tạm
-                
-                print(f"Đã tạo PDF tạm thời")
-                
-                # Resize PDF xuống 144x144
-                resize_pdf(temp_pdf_path, output_path)
-                
-                # Xóa file PDF tạm
-                if os.path.exists(temp_pdf_path):
-                    os.remove(temp_pdf_path)
-                
-                print(f"Đã chuyển đổi {image_file} thành {output_filename}")
-                
-            except Exception as e:
-                print(f"Lỗi khi xử lý {image_file}: {str(e)}")
         
+        # Bỏ các file đã bị xóa khỏi thư mục
+        for image_file in list(pending):
+            if image_file not in current:
+                del pending[image_file]
+        
+        stop_event.wait(poll_interval)
+
+def watch_directory(input_dir, output_dir, backend='native', workers=None, opencv_threads=None,
+                    queue_size=64, poll_interval=0.1, settle_time=0.3, process_existing=True,
+                    cache_dir=None, cache_max_bytes=CACHE_MAX_BYTES, tile_size=None, metrics_sink=None,
+                    stop_event=None, optimize=None, quantize_step=QUANTIZE_STEP, resolution='source',
+                    simplify='opencv', levels=None, palette=False, render_budget=None, budget_policy='simplify'):
+    """
+    Theo dõi input_dir và chuyển ngay các ảnh PNG/JPG mới hoặc vừa sửa thành PDF
+    
+    Args:
+        queue_size (int): Số ảnh tối đa chờ trong hàng đợi
+        poll_interval (float): Chu kỳ quét thư mục (giây)
+        settle_time (float): Thời gian file phải đứng yên trước khi xử lý (giây)
+        process_existing (bool): Xử lý cả các ảnh đã có sẵn khi bắt đầu
+        stop_event (threading.Event): Đặt event này để dừng (mặc định: chạy tới khi Ctrl+C)
+        Các tham số còn lại giống image_to_pdf
+    """
+    check_options(backend, resolution, simplify, levels, tile_size, render_budget, budget_policy)
+    optimizations = resolve_optimizations(optimize)
+    
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    cpu_count = os.cpu_count() or 1
+    workers = workers or cpu_count
+    if opencv_threads is None:
+        opencv_threads = max(1, cpu_count // workers)
+    
+    stop_event = stop_event or threading.Event()
+    job_queue = queue.Queue(maxsize=queue_size)
+    # Job mất kết quả vì pool hỏng: (job, số lần pool đã hỏng khi chạy nó),
+    # được giao lại trước các ảnh mới (xem WorkerPool)
+    retry_queue = queue.Queue()
+    # Chỉ giao cho pool tối đa `workers` ảnh một lúc, phần còn lại nằm trong
+    # hàng đợi có giới hạn để backpressure lan ngược về bộ quét
+    in_flight = threading.BoundedSemaphore(workers)
+    stats = {'converted': 0, 'errors': 0, 'hits': 0}
+    # report chạy trên thread callback của pool, job chạy riêng thì trên thread chính
+    stats_lock = threading.Lock()
+    sink = make_metrics_sink(metrics_sink)
+    
+    def finish(job, result):
+        latency = time.monotonic() - job['queued_at']
+        with stats_lock:
+            if sink is not None and 'metrics' in result:
+                sink(result['metrics'])
+            if result['error'] is None:
+                stats['converted'] += 1
+                stats['hits'] += result['cached']
+            else:
+                stats['errors'] += 1
+        if result['error'] is None:
+            size = ""
+            if result.get('bytes_before'):
+                size = f", {result['bytes_before']:,} -> {os.path.getsize(result['output']):,} bytes"
+            print(f"Đã chuyển đổi {result['file']} thành {os.path.basename(result['output'])} ({latency:.2f}s{size})")
+        else:
+            print(f"Lỗi khi xử lý {result['file']}: {result['error']}")
+    
+    def report(future, job, attempt):
+        in_flight.release()
+        try:
+            result = future.result()[0]
+        except BrokenProcessPool:
+            pool.restart(future.generation)
+            retry_queue.put((job, attempt + 1))
+            return
+        finish(job, result)
+    
+    scanner = threading.Thread(
+        target=_watch_scanner,
+        args=(input_dir, output_dir,
+              {'backend': backend, 'cache_dir': cache_dir, 'tile_size': tile_size, 'metrics': sink is not None,
+               'optimizations': optimizations, 'quantize_step': quantize_step, 'resolution': resolution,
+               'simplify': simplify, 'levels': levels, 'palette': palette,
+               'render_budget': resolve_render_budget(render_budget), 'budget_policy': budget_policy},
+              job_queue, stop_event, poll_interval, settle_time, process_existing),
+        daemon=True,
+    )
+    
+    print(f"Đang theo dõi thư mục {input_dir}... (Ctrl+C để dừng)")
+    pool = WorkerPool(workers, opencv_threads)
+    try:
+        scanner.start()
+        try:
+            while not stop_event.is_set():
+                try:
+                    job, attempt = retry_queue.get_nowait()
+                except queue.Empty:
+                    try:
+                        job, attempt = job_queue.get(timeout=poll_interval), 0
+                    except queue.Empty:
+                        continue
+                if attempt >= 2:
+                    # Pool hỏng hai lần khi đang chạy ảnh này: chạy riêng để chỉ nó bị ghi lỗi
+                    finish(job, pool.run_isolated(job))
+                    continue
+                while not in_flight.acquire(timeout=poll_interval):
+                    if stop_event.is_set():
+                        break
+                else:
+                    future = pool.submit([job])
+                    future.add_done_callback(lambda f, job=job, attempt=attempt: report(f, job, attempt))
+        except KeyboardInterrupt:
+            print("\nDừng theo dõi...")
+        finally:
+            stop_event.set()
+            scanner.join()
     finally:
-        # Dọn dẹp tất cả file tạm thời sau khi hoàn thành
-        print("\nĐang dọn dẹp file tạm thời...")
-        for tmp_svg, temp_path in temp_files:
-            try:
-                tmp_svg.close()
-                if os.path.exists(temp_path):
-                    os.unlink(temp_path)
-            except Exception as e:
-                print(f"Lỗi khi xóa file tạm thời {temp_path}: {e}")
-        print("Đã xóa tất cả file tạm thời")
+        pool.shutdown()
+    
+    if sink is not None and sink is not metrics_sink:
+        sink.close()
+    
+    if cache_dir:
+        evicted = prune_cache(cache_dir, cache_max_bytes)
+        print(f"Cache: {stats['hits']} hit, {stats['converted'] - stats['hits']} miss, đã xóa {evicted} mục cũ")
+    print(f"Đã chuyển đổi {stats['converted']} file, {stats['errors']} lỗi")
+    return stats
+
+@dataclass(frozen=True)
+class TraceConfig:
+    """
+    Tham số chuyển đổi dùng chung cho trace_file, trace_dir và CLI; ý nghĩa
+    từng trường giống các tham số cùng tên của image_to_pdf
+    """
+    backend: str = 'native'
+    tile_size: int = None
+    optimize: object = None
+    quantize_step: float = QUANTIZE_STEP
+    resolution: str = 'source'
+    simplify: str = 'opencv'
+    workers: int = None
+    chunksize: int = None
+    opencv_threads: int = None
+    cache_dir: str = None
+    cache_max_bytes: int = CACHE_MAX_BYTES
+    metrics_sink: object = None
+    profile_dir: str = None
+    profile_top: int = 10
+    pages_per_file: int = None
+    combined_name: str = 'combined'
+    pipeline: bool = False
+    queue_size: int = None
+    levels: int = None
+    palette: bool = False
+    memory_budget: int = None
+    shard: tuple = None
+    manifest: str = None
+    render_budget: object = None
+    budget_policy: str = 'simplify'
+    
+    def __post_init__(self):
+        check_options(self.backend, self.resolution, self.simplify, self.levels, self.tile_size,
+                      self.render_budget, self.budget_policy)
+        resolve_optimizations(self.optimize)
+    
+    def options(self):
+        """Các trường dưới dạng keyword arguments của image_to_pdf"""
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+def trace_file(input_path, output_path=None, config=None, **overrides):
+    """
+    Chuyển một file ảnh thành PDF, báo lỗi bằng exception
+    
+    Args:
+        output_path (str): File PDF đầu ra (mặc định: cùng tên với ảnh, đuôi .pdf)
+        config (TraceConfig): Tham số chuyển đổi (mặc định: TraceConfig())
+        overrides: Ghi đè từng trường của config
+    
+    Returns:
+        dict: {'file', 'output', 'bytes_before'}, thêm 'budget' khi vượt ngân sách vẽ
+    """
+    config = replace(config or TraceConfig(), **overrides)
+    if output_path is None:
+        output_path = os.path.splitext(input_path)[0] + '.pdf'
+    take_budget_log()
+    bytes_before = convert_image(input_path, output_path, config.backend, config.tile_size,
+                                 resolve_optimizations(config.optimize), config.quantize_step,
+                                 config.resolution, config.simplify, levels=config.levels, palette=config.palette,
+                                 render_budget=resolve_render_budget(config.render_budget),
+                                 budget_policy=config.budget_policy)
+    result = {'file': os.path.basename(input_path), 'output': output_path, 'bytes_before': bytes_before}
+    budget = take_budget_log()
+    if budget is not None:
+        result['budget'] = budget
+    return result
 
-# Thư mục input và output
-input_directory = "input"
-output_directory = "output"
+def trace_bytes(image, dpi=None, output=None, config=None, name='image', **overrides):
+    """
+    Chuyển ảnh trong bộ nhớ thành PDF 144x144, không tạo file tạm nào
+    
+    Args:
+        image (bytes | ndarray): Nội dung file PNG/JPEG, hoặc ảnh đã giải mã
+            (xám, BGR hoặc BGRA như cv2.imread)
+        dpi (float | tuple): DPI của ảnh; với bytes mặc định lấy từ header,
+            với mảng numpy mặc định 96
+        output (file-like): Ghi PDF vào đây thay vì trả về bytes
+        config (TraceConfig): Tham số chuyển đổi, overrides ghi đè từng trường
+        name (str): Tên ảnh dùng trong thông báo lỗi
+    
+    Returns:
+        bytes | None: Nội dung PDF, hoặc None khi đã ghi vào output
+    """
+    config = replace(config or TraceConfig(), **overrides)
+    if isinstance(image, np.ndarray):
+        img, header_dpi = image, (96, 96)
+    else:
+        with _stage('decode'):
+            img, header_dpi = decode_image(image, name)
+    if dpi is None:
+        dpi = header_dpi
+    elif np.isscalar(dpi):
+        dpi = (dpi, dpi)
+    
+    traced = _trace_image(img, dpi, config.tile_size, config.resolution, config.simplify,
+                          config.levels, config.palette, resolve_render_budget(config.render_budget),
+                          config.budget_policy)
+    target = io.BytesIO() if output is None else output
+    _write_traced(*traced, target, config.backend, resolve_optimizations(config.optimize), config.quantize_step,
+                  bool(config.levels))
+    return target.getvalue() if output is None else None
+
+def trace_dir(input_dir, output_dir, config=None, **overrides):
+    """Chuyển mọi ảnh trong input_dir theo config, trả về kết quả của image_to_pdf"""
+    config = replace(config or TraceConfig(), **overrides)
+    return image_to_pdf(input_dir, output_dir, **config.options())
+
+def _render_budget_arg(args):
+    """Ngân sách vẽ từ --render-budget và các --max-*: None, True hoặc dict giới hạn ghi đè"""
+    limits = {name: value for name, value in
+              (('contours', args.max_contours), ('vertices', args.max_vertices), ('bytes', args.max_bytes))
+              if value is not None}
+    return limits or args.render_budget or None
+
+def _shard_arg(text):
+    """'i/N' -> (i, N) cho --shard"""
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard phải có dạng i/N: {text}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard không hợp lệ: {text} (cần 0 <= i < N)")
+    return index, count
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chuyển ảnh PNG/JPG thành PDF vector 144x144")
+    parser.add_argument('input', nargs='?', default='input', help="File ảnh hoặc thư mục ảnh (mặc định: input)")
+    parser.add_argument('output', nargs='?', default='output',
+                        help="File PDF (khi input là file) hoặc thư mục đầu ra (mặc định: output)")
+    parser.add_argument('--backend', choices=BACKENDS, default='native')
+    parser.add_argument('--workers', type=int, help="Số process song song (mặc định: số CPU)")
+    parser.add_argument('--opencv-threads', type=int, help="Số thread OpenCV mỗi worker")
+    parser.add_argument('--tile-size', type=int, help="Xử lý ảnh lớn theo dải cao N pixel")
+    parser.add_argument('--optimize', nargs='*', choices=OPTIMIZATIONS,
+                        help="Tối ưu dung lượng PDF (không kèm tên = tất cả)")
+    parser.add_argument('--quantize-step', type=float, default=QUANTIZE_STEP)
+    parser.add_argument('--resolution', choices=RESOLUTIONS, default='source')
+    parser.add_argument('--simplify', choices=SIMPLIFY_METHODS, default='opencv')
+    parser.add_argument('--levels', type=int, help="Trace thành N lớp mức xám xếp chồng")
+    parser.add_argument('--palette', action='store_true', help="Với --levels, chia lớp theo bảng màu")
+    parser.add_argument('--cache-dir', help="Thư mục cache")
+    parser.add_argument('--metrics', help="File JSON lines ghi metrics của từng ảnh")
+    parser.add_argument('--pages-per-file', type=int, help="Gộp nhiều ảnh vào PDF nhiều trang (0 = một file)")
+    parser.add_argument('--pipeline', action='store_true', help="Đọc, xử lý và ghi file chồng lên nhau")
+    parser.add_argument('--queue-size', type=int, help="Sức chứa mỗi hàng đợi (pipeline/watch)")
+    parser.add_argument('--memory-budget', type=int, help="Tổng RSS tối đa của các worker (MB)")
+    parser.add_argument('--render-budget', action='store_true',
+                        help="Giới hạn số contour/điểm/bytes mỗi trang (RENDER_BUDGET)")
+    parser.add_argument('--max-contours', type=int, help="Ghi đè giới hạn số contour (bật --render-budget)")
+    parser.add_argument('--max-vertices', type=int, help="Ghi đè giới hạn số điểm (bật --render-budget)")
+    parser.add_argument('--max-bytes', type=int, help="Ghi đè giới hạn bytes content stream (bật --render-budget)")
+    parser.add_argument('--budget-policy', choices=BUDGET_POLICIES, default='simplify',
+                        help="Cách xử lý ảnh vượt ngân sách vẽ")
+    parser.add_argument('--shard', type=_shard_arg, help="Chỉ xử lý shard i trên N (dạng i/N, i từ 0)")
+    parser.add_argument('--manifest', help="File JSON lines ghi kết quả từng ảnh, chạy lại thì bỏ qua ảnh đã xong")
+    parser.add_argument('--watch', action='store_true', help="Theo dõi thư mục input (Ctrl+C để dừng)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Điểm vào dòng lệnh, trả về exit code (1 nếu có ảnh lỗi)"""
+    args = parse_args(argv)
+    # --optimize không kèm tên nghĩa là bật tất cả
+    optimize = None if args.optimize is None else (args.optimize or True)
+    config = TraceConfig(
+        backend=args.backend, tile_size=args.tile_size, optimize=optimize, quantize_step=args.quantize_step,
+        resolution=args.resolution, simplify=args.simplify, workers=args.workers,
+        opencv_threads=args.opencv_threads, cache_dir=args.cache_dir, metrics_sink=args.metrics,
+        pages_per_file=args.pages_per_file, pipeline=args.pipeline, queue_size=args.queue_size,
+        levels=args.levels, palette=args.palette,
+        memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None,
+        shard=args.shard, manifest=args.manifest,
+        render_budget=_render_budget_arg(args), budget_policy=args.budget_policy,
+    )
+    
+    if os.path.isfile(args.input):
+        output_path = args.output if args.output.lower().endswith('.pdf') else None
+        if output_path is None:
+            os.makedirs(args.output, exist_ok=True)
+            output_path = os.path.join(args.output, os.path.splitext(os.path.basename(args.input))[0] + '.pdf')
+        try:
+            result = trace_file(args.input, output_path, config)
+        except Exception as e:
+            print(f"Lỗi khi xử lý {os.path.basename(args.input)}: {e}")
+            return 1
+        print(f"Đã chuyển đổi {result['file']} thành {result['output']}")
+        return 0
+    
+    if not os.path.isdir(args.input):
+        print(f"Không tìm thấy file hoặc thư mục {args.input}")
+        return 1
+    
+    if args.watch:
+        stats = watch_directory(args.input, args.output, config.backend, config.workers, config.opencv_threads,
+                                queue_size=args.queue_size or 64, cache_dir=config.cache_dir,
+                                tile_size=config.tile_size, metrics_sink=config.metrics_sink,
+                                optimize=config.optimize, quantize_step=config.quantize_step,
+                                resolution=config.resolution, simplify=config.simplify,
+                                levels=config.levels, palette=config.palette,
+                                render_budget=config.render_budget, budget_policy=config.budget_policy)
+        return 1 if stats['errors'] else 0
+    
+    print("Bắt đầu chuyển đổi...")
+    results = trace_dir(args.input, args.output, config)
+    print("Hoàn thành")
+    return 1 if any(result['error'] is not None for result in results) else 0
 
-print("Bắt đầu chuyển đổi...")
-image_to_pdf(input_directory, output_directory)
-print("Hoàn thành")
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
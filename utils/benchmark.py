@@ -0,0 +1,345 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import io
+import resource
+import subprocess
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from trace_image import (
+    load_image, preprocess_image, find_contours, create_svg_path_from_contours,
+    create_svg_document, render_svg_to_pdf, resize_pdf, contours_to_pdf, BufferPool, MIN_CONTOUR_AREA,
+)
+from utils.simplify import filter_contours
+
+# Các loại ảnh tổng hợp và kích thước mặc định (cạnh dài, pixel)
+SYNTHETIC_KINDS = ('logo', 'glyphs', 'noisy', 'alpha')
+DEFAULT_SIZES = (256, 1024, 4096)
+
+# Thời gian import trace_image tối đa (giây) cho các lệnh ngắn và service
+STARTUP_BUDGET = 0.5
+
+# Các bước đo theo đúng thứ tự trong pipeline
+STAGES = ('decode', 'preprocess', 'find_contours', 'filter', 'serialize', 'render', 'resize', 'native_pdf')
+PIPELINES = {
+    'svg': ('decode', 'preprocess', 'find_contours', 'filter', 'serialize', 'render', 'resize'),
+    'native': ('decode', 'preprocess', 'find_contours', 'filter', 'native_pdf'),
+}
+
+def make_synthetic(kind, size, seed=0):
+    """
+    Tạo ảnh tổng hợp và mã hóa thành bytes
+
+    Args:
+        kind (str): 'logo' (hình khối lớn), 'glyphs' (trang ký tự),
+            'noisy' (ảnh scan nhiễu, JPEG), 'alpha' (PNG chỉ có kênh alpha)
+        size (int): Cạnh của ảnh vuông (pixel)
+
+    Returns:
+        tuple: (bytes đã mã hóa, phần mở rộng file)
+    """
+    rng = np.random.default_rng(seed)
+    scale = size / 256
+
+    if kind == 'noisy':
+        image = rng.integers(0, 256, (size, size), dtype=np.uint8)
+        image = cv2.GaussianBlur(image, (0, 0), 1.5 * scale)
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        return encoded.tobytes(), '.jpg'
+
+    canvas = np.zeros((size, size), np.uint8)
+    if kind in ('logo', 'alpha'):
+        for _ in range(8):
+            center = tuple(int(v) for v in rng.integers(0, size, 2))
+            radius = int(rng.integers(size // 16, size // 4))
+            cv2.circle(canvas, center, radius, 255, -1)
+            cv2.circle(canvas, center, radius // 2, 0, -1)
+        cv2.rectangle(canvas, (size // 10, size // 10), (size * 9 // 10, size * 9 // 10), 255, max(1, size // 64))
+    else:
+        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+        font_scale = 0.5 * scale
+        thickness = max(1, int(scale))
+        line_height = max(4, int(14 * scale))
+        for y in range(line_height, size, line_height):
+            text = ''.join(rng.choice(list(letters), 40))
+            cv2.putText(canvas, text, (2, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, 255, thickness, cv2.LINE_AA)
+
+    if kind == 'alpha':
+        image = np.zeros((size, size, 4), np.uint8)
+        image[:, :, 3] = canvas
+    else:
+        # preprocess_image trace vùng sáng, nên vẽ hình sáng trên nền tối
+        image = canvas
+    ok, encoded = cv2.imencode('.png', image)
+    return encoded.tobytes(), '.png'
+
+def _peak_rss_bytes():
+    """Peak RSS của process hiện tại (ru_maxrss là KB trên Linux, bytes trên macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _percentiles(values):
+    values = np.asarray(values) * 1000  # ms
+    return {
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'mean_ms': float(values.mean()),
+    }
+
+def bench_preprocess_memory(img, repeat=3):
+    """
+    Peak bộ nhớ (tracemalloc, numpy và OpenCV cấp phát qua numpy) và số lần
+    cấp phát ảnh trung gian của `repeat` lần preprocess_image, khi cấp phát
+    mới mỗi lần và khi dùng lại một BufferPool
+
+    Returns:
+        dict: {'alloc' | 'pooled': {'peak_bytes', 'allocations', 'allocated_bytes'}}
+    """
+    result = {}
+    for mode in ('alloc', 'pooled'):
+        pool = BufferPool(reuse=mode == 'pooled')
+        tracemalloc.start()
+        for _ in range(repeat):
+            preprocess_image(img, pool)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result[mode] = {'peak_bytes': peak, 'allocations': pool.allocations,
+                        'allocated_bytes': pool.allocated_bytes}
+    return result
+
+def bench_image(image_path, repeat=3):
+    """Chạy toàn bộ pipeline `repeat` lần trên một ảnh, đo thời gian từng bước"""
+    timings = {stage: [] for stage in STAGES}
+    result = {}
+    pool = BufferPool()
+
+    with tempfile.TemporaryDirectory() as work_dir, contextlib.redirect_stdout(io.StringIO()):
+        resized_pdf = os.path.join(work_dir, 'svg.pdf')
+        native_pdf = os.path.join(work_dir, 'native.pdf')
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            img, (dpi_x, dpi_y) = load_image(image_path)
+            timings['decode'].append(time.perf_counter() - start)
+
+            height, width = img.shape[:2]
+            width_pt = width / dpi_x * 72
+            height_pt = height / dpi_y * 72
+
+            start = time.perf_counter()
+            binary = preprocess_image(img, pool)
+            timings['preprocess'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            contours = find_contours(binary)
+            timings['find_contours'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            contours = filter_contours(contours, MIN_CONTOUR_AREA)
+            timings['filter'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            path_data = create_svg_path_from_contours(contours)
+            timings['serialize'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            svg = create_svg_document(path_data, width, height, width_pt, height_pt)
+            rendered = render_svg_to_pdf(svg)
+            timings['render'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            resize_pdf(rendered, resized_pdf)
+            timings['resize'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            contours_to_pdf(contours, width, height, width_pt, height_pt, native_pdf)
+            timings['native_pdf'].append(time.perf_counter() - start)
+
+            if _ == repeat - 1:
+                result['preprocess_memory'] = bench_preprocess_memory(img, repeat)
+            del img, binary
+
+        result['pixels'] = [width, height]
+        result['contours'] = len(contours)
+        result['vertices'] = int(sum(len(cnt) for cnt in contours))
+        result['output_bytes'] = {
+            'svg': os.path.getsize(resized_pdf),
+            'native': os.path.getsize(native_pdf),
+        }
+
+    result['stages'] = {stage: _percentiles(values) for stage, values in timings.items()}
+    result['images_per_sec'] = {}
+    for pipeline, stages in PIPELINES.items():
+        per_image = np.sum([timings[stage] for stage in stages], axis=0)
+        result['images_per_sec'][pipeline] = float(1 / per_image.mean())
+    result['peak_rss_bytes'] = _peak_rss_bytes()
+    return result
+
+def _run_isolated(image_path, repeat):
+    """Chạy bench_image trong process riêng để peak RSS chỉ tính cho ảnh đó"""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(bench_image, image_path, repeat).result()
+
+_STARTUP_SCRIPT = (
+    "import sys, time; start = time.perf_counter(); import trace_image; "
+    "print(time.perf_counter() - start, 'svglib.svglib' in sys.modules)"
+)
+
+def measure_startup(repeat=5):
+    """
+    Đo thời gian import trace_image trong process Python mới (lấy trung vị),
+    kiểm tra luôn là svglib/reportlab không bị import sẵn
+
+    Returns:
+        dict: {'import_s', 'svg_backend_imported'}
+    """
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], cwd=project_dir,
+                                capture_output=True, text=True, check=True).stdout
+        # Dòng cuối là kết quả (thư viện có thể in cảnh báo trước đó)
+        seconds, imported = output.strip().splitlines()[-1].split()
+        timings.append(float(seconds))
+    return {'import_s': float(np.median(timings)), 'svg_backend_imported': imported == 'True'}
+
+def run_benchmark(sizes=DEFAULT_SIZES, kinds=SYNTHETIC_KINDS, corpus_dir=None, repeat=3):
+    """
+    Chạy benchmark trên ảnh tổng hợp và (tùy chọn) các ảnh trong corpus_dir
+
+    Returns:
+        dict: {'cases': {tên case: kết quả}, ...} có thể lưu thành JSON
+    """
+    cases = {}
+    with tempfile.TemporaryDirectory() as input_dir:
+        for kind in kinds:
+            for size in sizes:
+                data, ext = make_synthetic(kind, size)
+                image_path = os.path.join(input_dir, f"{kind}_{size}{ext}")
+                with open(image_path, 'wb') as f:
+                    f.write(data)
+                name = f"{kind}_{size}"
+                print(f"Đang đo {name}...")
+                cases[name] = _run_isolated(image_path, repeat)
+                cases[name]['input_bytes'] = len(data)
+                os.remove(image_path)
+
+    if corpus_dir:
+        for image_file in sorted(os.listdir(corpus_dir)):
+            if not image_file.lower().endswith(('.png', '.jpg', '.jpeg')):
+                continue
+            image_path = os.path.join(corpus_dir, image_file)
+            name = f"corpus/{image_file}"
+            print(f"Đang đo {name}...")
+            cases[name] = _run_isolated(image_path, repeat)
+            cases[name]['input_bytes'] = os.path.getsize(image_path)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': repeat,
+        'opencv': cv2.__version__,
+        'startup': measure_startup(),
+        'cases': cases,
+    }
+
+def compare_to_baseline(results, baseline, threshold=0.1):
+    """
+    So sánh với kết quả baseline: coi là chậm đi khi images/sec giảm hoặc
+    p50 của một bước tăng quá `threshold` (tỷ lệ)
+
+    Returns:
+        list: Các dòng mô tả regression
+    """
+    regressions = []
+    for name, case in results['cases'].items():
+        base = baseline['cases'].get(name)
+        if base is None:
+            continue
+        for pipeline, value in case['images_per_sec'].items():
+            base_value = base['images_per_sec'].get(pipeline)
+            if base_value and value < base_value * (1 - threshold):
+                regressions.append(f"{name}: {pipeline} {value:.2f} ảnh/s (baseline {base_value:.2f})")
+        for stage, stats in case['stages'].items():
+            base_stats = base['stages'].get(stage)
+            if base_stats and stats['p50_ms'] > base_stats['p50_ms'] * (1 + threshold):
+                regressions.append(
+                    f"{name}: {stage} p50 {stats['p50_ms']:.2f} ms (baseline {base_stats['p50_ms']:.2f} ms)"
+                )
+    return regressions
+
+def check_startup(startup, budget=STARTUP_BUDGET):
+    """Các dòng mô tả vi phạm ngân sách khởi động"""
+    problems = []
+    if startup['import_s'] > budget:
+        problems.append(f"import trace_image mất {startup['import_s']:.3f}s (ngân sách {budget:.3f}s)")
+    if startup['svg_backend_imported']:
+        problems.append("svglib/reportlab bị import ngay khi import trace_image")
+    return problems
+
+def print_summary(results):
+    startup = results['startup']
+    print(f"\nThời gian import trace_image: {startup['import_s'] * 1000:.0f} ms")
+    print(f"\n{'Case':<24}{'svg ảnh/s':>12}{'native ảnh/s':>14}{'vertices':>12}{'PDF bytes':>12}{'peak RSS MB':>13}"
+          f"{'prep MB':>14}{'prep alloc':>12}")
+    for name, case in results['cases'].items():
+        memory = case['preprocess_memory']
+        print(f"{name:<24}"
+              f"{case['images_per_sec']['svg']:>12.2f}"
+              f"{case['images_per_sec']['native']:>14.2f}"
+              f"{case['vertices']:>12,}"
+              f"{case['output_bytes']['native']:>12,}"
+              f"{case['peak_rss_bytes'] / (1024 * 1024):>13.1f}"
+              f"{memory['alloc']['peak_bytes'] / (1024 * 1024):>7.1f}/{memory['pooled']['peak_bytes'] / (1024 * 1024):<6.1f}"
+              f"{memory['alloc']['allocations']:>6}/{memory['pooled']['allocations']:<5}")
+    print("(prep: peak MB và số lần cấp phát của preprocess_image, cấp phát mới/dùng BufferPool)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline trace_image")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="Kích thước ảnh tổng hợp (ví dụ: 256 1024 4096 16384)")
+    parser.add_argument('--kinds', nargs='+', choices=SYNTHETIC_KINDS, default=list(SYNTHETIC_KINDS))
+    parser.add_argument('--corpus', help="Thư mục ảnh thật cần đo thêm")
+    parser.add_argument('--repeat', type=int, default=3, help="Số lần chạy mỗi ảnh")
+    parser.add_argument('--output', default='bench_results.json', help="File JSON lưu kết quả")
+    parser.add_argument('--baseline', help="File JSON kết quả cũ để so sánh")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Ngưỡng regression (0.1 = chậm hơn 10%%)")
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET,
+                        help="Thời gian import trace_image tối đa (giây)")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.kinds, args.corpus, args.repeat)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print_summary(results)
+    print(f"\nĐã lưu kết quả vào {args.output}")
+
+    problems = check_startup(results['startup'], args.startup_budget)
+    if problems:
+        print("\nVượt ngân sách khởi động:")
+        for line in problems:
+            print(f"  - {line}")
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nPhát hiện {len(regressions)} regression:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\nKhông có regression so với baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import fitz  # PyMuPDF
+
+from trace_image import load_image, preprocess_image, fill_holes, page_transform, IMAGE_EXTENSIONS
+
+# Ngưỡng mặc định: IoU tối thiểu và sai số biên (p95, points trên trang 144x144).
+# Sai số biên không thể nhỏ hơn một pixel ảnh gốc, nên với ảnh nhỏ ngưỡng thực
+# tế là max(MAX_EDGE_PT, một pixel tính ra points)
+MIN_IOU = 0.85
+MAX_EDGE_PT = 0.5
+
+def rasterize_page(pdf_path, page_number, width, height, width_pt, height_pt):
+    """
+    Render vùng chứa ảnh trên trang PDF với mỗi pixel ảnh gốc ứng với một
+    pixel raster, trả về mask (vùng được tô = True) cùng kích thước ảnh
+    """
+    sx, _, _, d, offset_x, top = page_transform(width, height, width_pt, height_pt)
+    sy = -d
+    doc = fitz.open(pdf_path)
+    try:
+        page = doc[page_number]
+        # f của ma trận là mép trên của ảnh theo trục y hướng lên của PDF
+        top = page.rect.height - top
+        clip = fitz.Rect(offset_x, top, offset_x + width * sx, top + height * sy)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(1 / sx, 1 / sy), clip=clip,
+                                 colorspace=fitz.csGRAY, alpha=False)
+        raster = np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+    finally:
+        doc.close()
+
+    # Làm tròn khi render có thể lệch một hàng/cột
+    mask = np.zeros((height, width), bool)
+    rows, cols = min(height, raster.shape[0]), min(width, raster.shape[1])
+    mask[:rows, :cols] = raster[:rows, :cols] < 128
+    return mask
+
+def _edges(mask):
+    """
+    Các pixel biên của mask (uint8 0/255); đệm nền 1 pixel để hình chạm mép
+    ảnh cũng có biên ở mép, trả về mask lớn hơn ảnh 1 pixel mỗi phía
+    """
+    padded = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    return cv2.morphologyEx(padded, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8)) > 0
+
+def edge_distances(mask, reference):
+    """
+    Khoảng cách (pixel) từ mỗi pixel biên của mask tới biên gần nhất của
+    reference và ngược lại (hai chiều như khoảng cách Hausdorff)
+    """
+    mask_edges = _edges(mask)
+    reference_edges = _edges(reference)
+    if not mask_edges.any() or not reference_edges.any():
+        # Một bên trống: sai số bằng đường chéo ảnh nếu bên kia có biên
+        if mask_edges.any() or reference_edges.any():
+            return np.array([float(np.hypot(*mask.shape))])
+        return np.zeros(1)
+    to_reference = cv2.distanceTransform((~reference_edges).astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    to_mask = cv2.distanceTransform((~mask_edges).astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    return np.concatenate([to_reference[mask_edges], to_mask[reference_edges]])
+
+def check_file(image_path, pdf_path, page_number=0):
+    """
+    So sánh một trang PDF đầu ra với ảnh nhị phân của preprocess_image (đã tô
+    kín lỗ, vì trace chỉ lấy contour ngoài cùng)
+
+    Returns:
+        dict: {'file', 'pdf', 'page', 'iou', 'pixel_pt', 'edge_p95_px', 'edge_max_px',
+            'edge_p95_pt', 'edge_max_pt'} hoặc {'file', 'error'}
+    """
+    result = {'file': os.path.basename(image_path), 'pdf': os.path.basename(pdf_path), 'page': page_number + 1}
+    try:
+        img, (dpi_x, dpi_y) = load_image(image_path)
+        height, width = img.shape[:2]
+        width_pt = width / dpi_x * 72
+        height_pt = height / dpi_y * 72
+        reference = fill_holes(preprocess_image(img))
+        del img
+        rendered = rasterize_page(pdf_path, page_number, width, height, width_pt, height_pt)
+    except Exception as e:
+        result['error'] = str(e)
+        return result
+
+    expected = reference > 0
+    union = np.count_nonzero(rendered | expected)
+    result['iou'] = float(np.count_nonzero(rendered & expected) / union) if union else 1.0
+
+    distances = edge_distances(rendered.astype(np.uint8) * 255, reference)
+    sx, _, _, d, _, _ = page_transform(width, height, width_pt, height_pt)
+    pixel_pt = max(sx, -d)
+    result['pixel_pt'] = pixel_pt
+    result['edge_p95_px'] = float(np.percentile(distances, 95))
+    result['edge_max_px'] = float(distances.max())
+    result['edge_p95_pt'] = result['edge_p95_px'] * pixel_pt
+    result['edge_max_pt'] = result['edge_max_px'] * pixel_pt
+    return result
+
+def _check_job(job):
+    return check_file(*job)
+
+def find_outputs(input_dir, output_dir):
+    """
+    Ghép mỗi ảnh trong input_dir với PDF đầu ra: {tên}.pdf, hoặc trang tương
+    ứng trong file gộp theo các file *_index.json
+
+    Returns:
+        list: Các tuple (đường dẫn ảnh, đường dẫn PDF, số trang bắt đầu từ 0)
+    """
+    pages = {}
+    for name in sorted(os.listdir(output_dir)):
+        if name.endswith('_index.json'):
+            with open(os.path.join(output_dir, name), encoding='utf-8') as f:
+                for image_file, entry in json.load(f).items():
+                    pages[image_file] = (os.path.join(output_dir, entry['output']), entry['page'] - 1)
+
+    jobs = []
+    for image_file in sorted(os.listdir(input_dir)):
+        if not image_file.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image_path = os.path.join(input_dir, image_file)
+        pdf_path = os.path.join(output_dir, os.path.splitext(image_file)[0] + '.pdf')
+        if os.path.exists(pdf_path):
+            jobs.append((image_path, pdf_path, 0))
+        elif image_file in pages:
+            jobs.append((image_path, *pages[image_file]))
+    return jobs
+
+def check_directory(input_dir, output_dir, workers=None, min_iou=MIN_IOU, max_edge_pt=MAX_EDGE_PT):
+    """
+    Kiểm tra song song mọi ảnh có PDF đầu ra, đánh dấu 'passed' cho từng file
+
+    Returns:
+        list: Kết quả của check_file, thêm 'passed'
+    """
+    jobs = find_outputs(input_dir, output_dir)
+    if workers == 1 or len(jobs) <= 1:
+        results = [_check_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_check_job, jobs))
+
+    for result in results:
+        result['passed'] = bool('error' not in result
+                                and result['iou'] >= min_iou
+                                and result['edge_p95_pt'] <= max(max_edge_pt, result['pixel_pt']))
+    return results
+
+def print_report(results):
+    print(f"{'File':<32}{'IoU':>8}{'biên p95 (pt)':>15}{'biên max (pt)':>15}  Kết quả")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['file']:<32}  Lỗi: {result['error']}")
+            continue
+        print(f"{result['file']:<32}"
+              f"{result['iou']:>8.4f}"
+              f"{result['edge_p95_pt']:>15.3f}"
+              f"{result['edge_max_pt']:>15.3f}"
+              f"  {'OK' if result['passed'] else 'FAIL'}")
+    passed = sum(1 for result in results if result['passed'])
+    print(f"\n{passed}/{len(results)} file đạt yêu cầu")
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra độ chính xác của PDF đầu ra so với ảnh gốc")
+    parser.add_argument('--input', default='input', help="Thư mục ảnh gốc")
+    parser.add_argument('--output', default='output', help="Thư mục PDF đầu ra")
+    parser.add_argument('--workers', type=int, help="Số process song song (mặc định: số CPU)")
+    parser.add_argument('--min-iou', type=float, default=MIN_IOU, help="IoU tối thiểu")
+    parser.add_argument('--max-edge', type=float, default=MAX_EDGE_PT,
+                        help="Sai số biên p95 tối đa (points trên trang 144x144, không nhỏ hơn một pixel ảnh gốc)")
+    parser.add_argument('--report', help="File JSON lưu kết quả chi tiết")
+    args = parser.parse_args()
+
+    results = check_directory(args.input, args.output, args.workers, args.min_iou, args.max_edge)
+    print_report(results)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Đã lưu kết quả vào {args.report}")
+
+    if not all(result['passed'] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,16 @@
 import os
-from PIL import Image
 import fitz  # PyMuPDF
-import cv2
-import numpy as np
+from utils.image_header import read_image_header_file
 
 def get_image_size(image_path):
     """
     Lấy kích thước của file ảnh theo nhiều đơn vị đo
     """
     try:
-        # Đọc ảnh bằng PIL để lấy DPI
-        pil_img = Image.open(image_path)
-        width, height = pil_img.size
-        dpi_x, dpi_y = pil_img.info.get('dpi', (96, 96))
+        # Chỉ đọc header để lấy kích thước và DPI, không giải mã pixel
+        header = read_image_header_file(image_path)
+        width, height = header['width'], header['height']
+        dpi_x, dpi_y = header['dpi'] or (96, 96)
         
         # Tính kích thước thực tế
         width_inch = width / dpi_x
@@ -0,0 +1,130 @@
+import mmap
+import struct
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Các marker SOF của JPEG chứa kích thước ảnh (trừ DHT, JPG, DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Số kênh OpenCV trả về (IMREAD_UNCHANGED) theo color type của PNG
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 4, 6: 4}
+
+def _png_header(data):
+    """Đọc kích thước từ IHDR và DPI từ pHYs (dừng ở IDAT, không giải nén pixel)"""
+    width, height = struct.unpack('>II', data[16:24])
+    bit_depth, color_type = data[24], data[25]
+    channels = PNG_CHANNELS.get(color_type, 4)
+    dpi = None
+    pos = 8
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+        if chunk_type == b'pHYs' and length >= 9:
+            px, py, unit = struct.unpack('>IIB', data[pos + 8:pos + 17])
+            if unit == 1:  # pixel trên mét
+                dpi = (px * 0.0254, py * 0.0254)
+        elif chunk_type == b'tRNS':  # OpenCV thêm kênh alpha
+            channels = 4
+        pos += 12 + length
+    return width, height, dpi, channels, bit_depth
+
+def _exif_dpi(exif):
+    """DPI từ XResolution/ResolutionUnit trong IFD0 của EXIF (giống cách PIL xử lý)"""
+    try:
+        byte_order = '<' if exif[:2] == b'II' else '>'
+        ifd_offset = struct.unpack(byte_order + 'I', exif[4:8])[0]
+        count = struct.unpack(byte_order + 'H', exif[ifd_offset:ifd_offset + 2])[0]
+        tags = {}
+        for i in range(count):
+            entry = ifd_offset + 2 + i * 12
+            tag, tag_type = struct.unpack(byte_order + 'HH', exif[entry:entry + 4])
+            if tag == 0x0128 and tag_type == 3:  # ResolutionUnit (SHORT)
+                tags[tag] = struct.unpack(byte_order + 'H', exif[entry + 8:entry + 10])[0]
+            elif tag == 0x011A and tag_type == 5:  # XResolution (RATIONAL)
+                value_offset = struct.unpack(byte_order + 'I', exif[entry + 8:entry + 12])[0]
+                tags[tag] = struct.unpack(byte_order + 'II', exif[value_offset:value_offset + 8])
+        numerator, denominator = tags[0x011A]
+        dpi = numerator / denominator
+        if tags[0x0128] == 3:  # dots per cm
+            dpi *= 2.54
+        return (dpi, dpi)
+    except (struct.error, KeyError, ZeroDivisionError):
+        # PIL cũng trả về 72 DPI khi EXIF không đọc được hoặc thiếu thông tin
+        return (72, 72)
+
+def _jpeg_header(data):
+    """Đọc kích thước từ SOF và DPI từ JFIF (APP0) hoặc EXIF (APP1), dừng ở SOS"""
+    width = height = None
+    dpi = None
+    exif = None
+    channels = 3
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("JPEG header không hợp lệ")
+        marker = data[pos + 1]
+        if marker == 0xFF:  # byte đệm
+            pos += 1
+            continue
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:  # marker không có dữ liệu
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):  # EOI/SOS: hết phần header
+            break
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        segment = data[pos + 4:pos + 2 + length]
+        if marker == 0xE0 and segment[:4] == b'JFIF' and len(segment) >= 12:
+            unit = segment[7]
+            density = struct.unpack('>HH', segment[8:12])
+            if unit == 1:
+                dpi = density
+            elif unit == 2:  # dots per cm
+                dpi = tuple(d * 2.54 for d in density)
+        elif marker == 0xE1 and segment[:6] == b'Exif\0\0' and exif is None:
+            exif = segment[6:]
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', segment[1:5])
+            # Ảnh xám giữ một kênh, YCbCr/CMYK được giải mã thành BGR
+            channels = 1 if segment[5] == 1 else 3
+        pos += 2 + length
+
+    if width is None:
+        raise ValueError("Không tìm thấy kích thước ảnh trong JPEG header")
+    if dpi is None and exif is not None:
+        dpi = _exif_dpi(exif)
+    return width, height, dpi, channels, 8
+
+def read_image_header(data):
+    """
+    Đọc kích thước và DPI từ header của ảnh PNG/JPEG mà không giải mã pixel
+
+    Args:
+        data (bytes | mmap): Nội dung file ảnh
+
+    Returns:
+        dict: {'format', 'width', 'height', 'dpi', 'channels', 'bit_depth'};
+            'dpi' là None nếu header không có thông tin DPI, 'channels' là số
+            kênh của ảnh cv2.imread(IMREAD_UNCHANGED)
+    """
+    if data[:8] == PNG_SIGNATURE:
+        image_format = 'PNG'
+        width, height, dpi, channels, bit_depth = _png_header(data)
+    elif data[:2] == b'\xff\xd8':
+        image_format = 'JPEG'
+        width, height, dpi, channels, bit_depth = _jpeg_header(data)
+    else:
+        raise ValueError("Chỉ hỗ trợ ảnh PNG và JPEG")
+
+    # DPI bằng 0 coi như không có
+    if dpi is not None and not all(dpi):
+        dpi = None
+
+    return {'format': image_format, 'width': width, 'height': height, 'dpi': dpi,
+            'channels': channels, 'bit_depth': bit_depth}
+
+def read_image_header_file(image_path):
+    """Đọc header của file ảnh qua mmap, chỉ các trang chứa header được nạp từ đĩa"""
+    with open(image_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return read_image_header(data)
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import argparse
+
+from trace_image import read_manifest, shard_of, IMAGE_EXTENSIONS
+
+def merge_manifests(manifest_paths, input_dir=None):
+    """
+    Gộp manifest của các shard thành một báo cáo. Với mỗi ảnh, bản ghi mới
+    nhất (theo thời gian ghi) thắng, nên ảnh lỗi đã chạy lại thành công
+    được tính là xong
+
+    Args:
+        manifest_paths (list): Các file manifest (JSON lines) của image_to_pdf
+        input_dir (str): Thư mục ảnh gốc; khi có, liệt kê cả các ảnh chưa có
+            bản ghi nào cùng shard của chúng
+
+    Returns:
+        dict: {'files': {tên ảnh: bản ghi}, 'shards': {'i/N': {'runs', 'files',
+            'ok', 'failed'}}, 'missing_shards', 'ok', 'failed', 'missing'}
+    """
+    files = {}
+    shards = {}
+    for path in manifest_paths:
+        for record in read_manifest(path):
+            shard = record.get('shard') or '0/1'
+            entry = shards.setdefault(shard, {'runs': 0, 'files': None, 'ok': 0, 'failed': 0})
+            if record.get('type') == 'run':
+                entry['runs'] += 1
+                entry['files'] = record['files']
+            elif record.get('type') == 'file':
+                previous = files.get(record['file'])
+                if previous is None or record['time'] >= previous['time']:
+                    files[record['file']] = record
+
+    for record in files.values():
+        shards[record.get('shard') or '0/1']['ok' if record['status'] == 'ok' else 'failed'] += 1
+
+    # Shard không có manifest nào (máy chưa chạy hoặc mất file manifest)
+    count = max((int(shard.split('/')[1]) for shard in shards), default=1)
+    missing_shards = [f"{index}/{count}" for index in range(count) if f"{index}/{count}" not in shards]
+
+    failed = [
+        {'file': name, 'error': record['error'], 'shard': record.get('shard'), 'host': record.get('host')}
+        for name, record in sorted(files.items()) if record['status'] != 'ok'
+    ]
+    missing = []
+    if input_dir:
+        expected = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        missing = [{'file': name, 'shard': f"{shard_of(name, count)}/{count}"}
+                   for name in expected if name not in files]
+
+    return {
+        'files': files,
+        'shards': dict(sorted(shards.items())),
+        'missing_shards': missing_shards,
+        'ok': sum(1 for record in files.values() if record['status'] == 'ok'),
+        'failed': failed,
+        'missing': missing,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Gộp manifest của các shard, liệt kê ảnh thiếu hoặc lỗi")
+    parser.add_argument('manifests', nargs='+', help="Các file manifest của từng shard")
+    parser.add_argument('--input', help="Thư mục ảnh gốc để tìm các ảnh chưa được xử lý")
+    parser.add_argument('--report', default='manifest_report.json', help="File báo cáo JSON")
+    args = parser.parse_args()
+
+    report = merge_manifests(args.manifests, args.input)
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for shard, entry in report['shards'].items():
+        total = '?' if entry['files'] is None else entry['files']
+        print(f"Shard {shard}: {entry['ok']} xong, {entry['failed']} lỗi / {total} file ({entry['runs']} lần chạy)")
+    for shard in report['missing_shards']:
+        print(f"Shard {shard}: không có manifest")
+    print(f"Tổng: {report['ok']} xong, {len(report['failed'])} lỗi, {len(report['missing'])} thiếu")
+
+    if report['failed']:
+        print("\nẢnh lỗi:")
+        for entry in report['failed']:
+            print(f"  {entry['file']} (shard {entry['shard']}, {entry['host']}): {entry['error']}")
+    if report['missing']:
+        print("\nẢnh chưa được xử lý:")
+        for entry in report['missing']:
+            print(f"  {entry['file']} (shard {entry['shard']})")
+    print(f"\nĐã lưu báo cáo vào {args.report}")
+
+    if report['failed'] or report['missing'] or report['missing_shards']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import os
+import csv
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+
+INDEX_VERSION = 1
+DEFAULT_INDEX = '.pdf_index.json'
+
+# Các cột của báo cáo so sánh (CSV giữ đúng thứ tự này)
+REPORT_FIELDS = (
+    'filename', 'status', 'bytes', 'orig_bytes', 'size_diff_percent',
+    'width_pt', 'height_pt', 'orig_width_pt', 'orig_height_pt', 'pages', 'orig_pages', 'same_md5',
+)
+
+def inventory_file(pdf_path):
+    """
+    Đọc file PDF đúng một lần: nội dung được đọc vào bộ nhớ bằng một lần
+    read, băm MD5 trên cả buffer rồi mở bằng PyMuPDF từ chính buffer đó
+
+    Returns:
+        dict: {'filename', 'bytes', 'md5', 'pages', 'width_pt', 'height_pt',
+            'metadata'} hoặc {'filename', 'error'}
+    """
+    info = {'filename': os.path.basename(pdf_path)}
+    try:
+        with open(pdf_path, 'rb') as f:
+            data = f.read()
+        info['bytes'] = len(data)
+        # hashlib nhả GIL với buffer lớn nên băm song song được trên thread pool
+        info['md5'] = hashlib.md5(data).hexdigest()
+        with fitz.open(stream=data, filetype='pdf') as doc:
+            info['pages'] = len(doc)
+            mediabox = doc[0].mediabox
+            info['width_pt'] = mediabox.width
+            info['height_pt'] = mediabox.height
+            info['metadata'] = doc.metadata
+    except Exception as e:
+        return {'filename': os.path.basename(pdf_path), 'error': str(e)}
+    return info
+
+def _file_key(stat):
+    return [stat.st_mtime_ns, stat.st_size]
+
+def load_index(index_path):
+    """Đọc index đã lưu ({đường dẫn tuyệt đối: thông tin}), trả về {} nếu chưa có hoặc khác phiên bản"""
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index['files']
+
+def save_index(index_path, files):
+    """Ghi index ra file tạm rồi rename để không bao giờ để lại index dở dang"""
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'files': files}, f, ensure_ascii=False)
+    os.replace(temp_path, index_path)
+
+def build_inventory(directories, index_path=None, workers=None):
+    """
+    Lập inventory cho mọi file PDF trong các thư mục. Chỉ đọc lại các file
+    mới hoặc đã đổi (khác mtime/size so với index), các file còn lại lấy từ index
+
+    Args:
+        directories (iterable): Các thư mục chứa PDF
+        index_path (str): File JSON lưu index giữa các lần chạy, None = không lưu
+        workers (int): Số thread đọc file (mặc định của ThreadPoolExecutor)
+
+    Returns:
+        tuple: ({đường dẫn tuyệt đối: thông tin}, số file đã đọc lại)
+    """
+    cached = load_index(index_path) if index_path else {}
+    inventory = {}
+    pending = []
+    for directory in directories:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not (entry.name.lower().endswith('.pdf') and entry.is_file()):
+                    continue
+                path = os.path.abspath(entry.path)
+                key = _file_key(entry.stat())
+                entry_info = cached.get(path)
+                if entry_info is not None and entry_info['key'] == key:
+                    inventory[path] = entry_info
+                else:
+                    pending.append((path, key))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (path, key), info in zip(pending, executor.map(inventory_file, [path for path, _ in pending])):
+            info['key'] = key
+            inventory[path] = info
+
+    if index_path:
+        # Giữ lại mục của các thư mục khác để dùng chung một index
+        scanned = tuple(os.path.join(os.path.abspath(d), '') for d in directories)
+        files = {path: info for path, info in cached.items() if not path.startswith(scanned)}
+        files.update(inventory)
+        save_index(index_path, files)
+    return inventory, len(pending)
+
+def compare_directories(output_dir, compare_dir, index_path=None, workers=None):
+    """
+    So sánh PDF cùng tên trong output_dir (file mới) và compare_dir (file gốc)
+    bằng một lượt inventory chung cho cả hai thư mục
+
+    Returns:
+        tuple: (danh sách dòng báo cáo theo REPORT_FIELDS, số file đã đọc lại)
+    """
+    inventory, scanned = build_inventory([output_dir, compare_dir], index_path, workers)
+    output_dir = os.path.abspath(output_dir)
+    compare_dir = os.path.abspath(compare_dir)
+
+    rows = []
+    for pdf_file in sorted(os.path.basename(path) for path in inventory if os.path.dirname(path) == output_dir):
+        new = inventory[os.path.join(output_dir, pdf_file)]
+        orig = inventory.get(os.path.join(compare_dir, pdf_file))
+        row = dict.fromkeys(REPORT_FIELDS)
+        row['filename'] = pdf_file
+        if orig is None:
+            row['status'] = 'missing_original'
+        elif 'error' in new or 'error' in orig:
+            row['status'] = 'error: ' + new.get('error', orig.get('error', ''))
+        else:
+            row['status'] = 'ok'
+            row['orig_bytes'] = orig['bytes']
+            row['orig_width_pt'] = orig['width_pt']
+            row['orig_height_pt'] = orig['height_pt']
+            row['orig_pages'] = orig['pages']
+            row['same_md5'] = new['md5'] == orig['md5']
+            # Dương: file mới lớn hơn file gốc
+            row['size_diff_percent'] = (new['bytes'] - orig['bytes']) / orig['bytes'] * 100 if orig['bytes'] else None
+        if 'error' not in new:
+            row['bytes'] = new['bytes']
+            row['width_pt'] = new['width_pt']
+            row['height_pt'] = new['height_pt']
+            row['pages'] = new['pages']
+        rows.append(row)
+    return rows, scanned
+
+def write_report(rows, report_path):
+    """Ghi báo cáo ra CSV hoặc JSON tùy phần mở rộng của report_path"""
+    if report_path.lower().endswith('.csv'):
+        with open(report_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Lập inventory và so sánh các file PDF")
+    parser.add_argument('--output', default='output', help="Thư mục PDF được tạo mới")
+    parser.add_argument('--compare', default='ok_file', help="Thư mục PDF gốc để so sánh")
+    parser.add_argument('--index', default=DEFAULT_INDEX, help="File index giữa các lần chạy ('' = không lưu)")
+    parser.add_argument('--workers', type=int, help="Số thread đọc file")
+    parser.add_argument('--report', default='pdf_report.csv', help="File báo cáo (.csv hoặc .json)")
+    args = parser.parse_args()
+
+    rows, scanned = compare_directories(args.output, args.compare, args.index or None, args.workers)
+    write_report(rows, args.report)
+    problems = sum(1 for row in rows if row['status'] != 'ok')
+    print(f"Đã so sánh {len(rows)} file ({scanned} file đọc lại), {problems} file thiếu bản gốc hoặc lỗi")
+    print(f"Đã lưu báo cáo vào {args.report}")
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
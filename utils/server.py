@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import argparse
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import cv2
+import numpy as np
+
+from trace_image import TraceConfig, trace_bytes, BACKENDS, RESOLUTIONS, SIMPLIFY_METHODS, OPTIMIZATIONS
+
+DEFAULT_PORT = 8765
+# Kích thước ảnh tối đa nhận qua HTTP (bytes)
+MAX_PAYLOAD_BYTES = 64 * 1024 * 1024
+# Thời gian tối đa cho một request (giây)
+REQUEST_TIMEOUT = 30
+# Số latency gần nhất dùng để tính p50/p99
+LATENCY_WINDOW = 1000
+
+def _init_worker(opencv_threads, backend):
+    """Làm nóng worker: giới hạn thread OpenCV và import sẵn backend svg nếu dùng"""
+    cv2.setNumThreads(opencv_threads)
+    if backend == 'svg':
+        import svglib.svglib  # noqa: F401
+        import reportlab.graphics.renderPDF  # noqa: F401
+
+def _warm_up():
+    """Chuyển một ảnh nhỏ để nạp sẵn code của OpenCV/fitz trong worker"""
+    image = np.zeros((32, 32), np.uint8)
+    cv2.circle(image, (16, 16), 8, 255, -1)
+    ok, encoded = cv2.imencode('.png', image)
+    convert_bytes(encoded.tobytes(), 'warmup.png', TraceConfig())
+    return os.getpid()
+
+def convert_bytes(data, name, config):
+    """Chuyển nội dung file ảnh thành PDF 144x144 (chạy trong worker), trả về bytes"""
+    return trace_bytes(data, config=config, name=name)
+
+class ServerStats:
+    """Số request, lỗi, timeout và latency gần nhất của server (dùng chung giữa các thread)"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def begin(self, limit):
+        """Nhận thêm một request nếu số request đang xử lý chưa tới limit"""
+        with self.lock:
+            if self.in_flight >= limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def end(self, latency, status, release=True):
+        """
+        Ghi kết quả một request; release=False khi job vẫn còn chạy trong
+        worker (quá thời gian), gọi release() khi job thực sự xong
+        """
+        with self.lock:
+            if release:
+                self.in_flight -= 1
+            self.requests += 1
+            self.latencies.append(latency)
+            if status == 'error':
+                self.errors += 1
+            elif status == 'timeout':
+                self.timeouts += 1
+    
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        with self.lock:
+            latencies = np.asarray(self.latencies) * 1000
+            in_flight = self.in_flight
+            stats = {
+                'uptime_s': time.time() - self.started,
+                'requests': self.requests,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'in_flight': in_flight,
+            }
+        # Các request vượt quá số worker đang chờ trong hàng đợi của pool
+        stats['queue_length'] = max(0, in_flight - self.workers)
+        stats['workers'] = self.workers
+        stats['p50_ms'] = float(np.percentile(latencies, 50)) if len(latencies) else None
+        stats['p99_ms'] = float(np.percentile(latencies, 99)) if len(latencies) else None
+        return stats
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    """
+    POST /convert (body là nội dung file ảnh, ?name=tên file) -> PDF,
+    GET /stats -> JSON thống kê, GET /health -> 200
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body, content_type='application/json'):
+        if isinstance(body, dict):
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/stats':
+            self._reply(200, self.server.stats.snapshot())
+        elif path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'Không tìm thấy'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/convert':
+            self._reply(404, {'error': 'Không tìm thấy'})
+            return
+        server = self.server
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self._reply(411, {'error': 'Thiếu Content-Length'})
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._reply(400, {'error': 'Content-Length không hợp lệ'})
+            return
+        if length > server.max_payload:
+            # Không đọc body quá lớn, đóng kết nối sau khi trả lời
+            self.close_connection = True
+            self._reply(413, {'error': f"Ảnh lớn hơn {server.max_payload:,} bytes"})
+            return
+        data = self.rfile.read(length)
+        name = parse_qs(url.query).get('name', ['image'])[0]
+
+        if not server.stats.begin(server.workers + server.max_queue):
+            self._reply(503, {'error': 'Server đang quá tải, thử lại sau'})
+            return
+
+        start = time.perf_counter()
+        status = 'ok'
+        future = server.executor.submit(convert_bytes, data, name, server.config)
+        try:
+            pdf = future.result(timeout=server.request_timeout)
+        except TimeoutError:
+            # Bỏ job nếu chưa chạy; job đang chạy sẽ chạy nốt trong worker và
+            # vẫn được tính vào in_flight (giới hạn nhận request) tới khi xong
+            future.cancel()
+            future.add_done_callback(lambda f: server.stats.release())
+            status = 'timeout'
+            self._reply(504, {'error': f"Quá thời gian {server.request_timeout}s"})
+        except ValueError as e:  # Ảnh không đọc được
+            status = 'error'
+            self._reply(400, {'error': str(e)})
+        except Exception as e:
+            status = 'error'
+            self._reply(500, {'error': str(e)})
+        else:
+            self._reply(200, pdf, 'application/pdf')
+        finally:
+            server.stats.end(time.perf_counter() - start, status, release=status != 'timeout')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def make_server(host='127.0.0.1', port=DEFAULT_PORT, config=None, workers=None, opencv_threads=None,
+                max_payload=MAX_PAYLOAD_BYTES, timeout=REQUEST_TIMEOUT, max_queue=None, verbose=False):
+    """
+    Tạo HTTP server với pool process đã làm nóng
+
+    Args:
+        config (TraceConfig): Tham số chuyển đổi cho mọi request
+        workers (int): Số process chuyển đổi (mặc định: số CPU)
+        max_payload (int): Kích thước ảnh tối đa (bytes), lớn hơn trả về 413
+        timeout (float): Thời gian tối đa mỗi request (giây), quá thì trả về 504
+        max_queue (int): Số request tối đa chờ worker, vượt quá trả về 503
+            (mặc định: 4 * workers)
+
+    Returns:
+        ThreadingHTTPServer: Gọi serve_forever() để chạy, shutdown_server() để dừng
+    """
+    config = config or TraceConfig()
+    cpu_count = os.cpu_count() or 1
+    workers = workers or cpu_count
+    if opencv_threads is None:
+        opencv_threads = max(1, cpu_count // workers)
+
+    server = ThreadingHTTPServer((host, port), ConversionHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.workers = workers
+    server.max_payload = max_payload
+    server.request_timeout = timeout
+    server.max_queue = 4 * workers if max_queue is None else max_queue
+    server.verbose = verbose
+    server.stats = ServerStats(workers)
+    server.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                          initargs=(opencv_threads, config.backend))
+    # Mỗi worker chạy một ảnh nhỏ trước khi nhận request thật
+    for future in [server.executor.submit(_warm_up) for _ in range(workers)]:
+        future.result()
+    return server
+
+def shutdown_server(server):
+    server.shutdown()
+    server.server_close()
+    server.executor.shutdown(cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Server chuyển ảnh thành PDF trên localhost")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, help="Số process chuyển đổi (mặc định: số CPU)")
+    parser.add_argument('--backend', choices=BACKENDS, default='native')
+    parser.add_argument('--resolution', choices=RESOLUTIONS, default='source')
+    parser.add_argument('--simplify', choices=SIMPLIFY_METHODS, default='opencv')
+    parser.add_argument('--optimize', nargs='*', choices=OPTIMIZATIONS,
+                        help="Tối ưu dung lượng PDF (không kèm tên = tất cả)")
+    parser.add_argument('--max-payload', type=int, default=MAX_PAYLOAD_BYTES, help="Kích thước ảnh tối đa (bytes)")
+    parser.add_argument('--timeout', type=float, default=REQUEST_TIMEOUT, help="Thời gian tối đa mỗi request (giây)")
+    parser.add_argument('--max-queue', type=int, help="Số request tối đa chờ worker")
+    parser.add_argument('--verbose', action='store_true', help="In log từng request")
+    args = parser.parse_args()
+
+    optimize = None if args.optimize is None else (args.optimize or True)
+    config = TraceConfig(backend=args.backend, resolution=args.resolution, simplify=args.simplify,
+                         optimize=optimize)
+    server = make_server(args.host, args.port, config, args.workers, max_payload=args.max_payload,
+                         timeout=args.timeout, max_queue=args.max_queue, verbose=args.verbose)
+    print(f"Đang chạy tại http://{args.host}:{args.port} với {server.workers} worker (Ctrl+C để dừng)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nDừng server...")
+    finally:
+        server.server_close()
+        server.executor.shutdown(cancel_futures=True)
+
+if __name__ == "__main__":
+    main()
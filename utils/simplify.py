@@ -0,0 +1,262 @@
+import itertools
+
+import numpy as np
+
+def pack_contours(contours):
+    """
+    Gộp danh sách contour thành một mảng điểm liền
+
+    Returns:
+        tuple: (points (N, 2), starts (M,), counts (M,)); contour thứ i là
+            points[starts[i]:starts[i] + counts[i]]
+    """
+    counts = np.fromiter(map(len, contours), np.int64, len(contours))
+    starts = np.zeros(len(contours), np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    if len(contours) == 0:
+        return np.empty((0, 2), np.int32), starts, counts
+    return np.concatenate(contours).reshape(-1, 2), starts, counts
+
+def unpack_contours(points, keep, starts, counts):
+    """Tách các điểm được giữ (mask keep) thành danh sách mảng (n, 2) theo từng contour"""
+    ends = np.cumsum(np.add.reduceat(keep.astype(np.int64), starts)).tolist()
+    kept = points[keep]
+    return [kept[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+def _neighbors(starts, counts):
+    """Chỉ số điểm trước và sau của mỗi điểm trong contour khép kín"""
+    total = int(counts.sum())
+    previous = np.arange(-1, total - 1)
+    following = np.arange(1, total + 1)
+    ends = starts + counts - 1
+    previous[starts] = ends
+    following[ends] = starts
+    return previous, following
+
+def contour_areas(points, starts, counts):
+    """Diện tích của mọi contour (công thức shoelace, giống cv2.contourArea)"""
+    if len(starts) == 0:
+        return np.empty(0)
+    x = points[:, 0].astype(np.float64)
+    y = points[:, 1].astype(np.float64)
+    # Điểm kế tiếp của điểm cuối mỗi contour là điểm đầu của contour đó
+    x_next = np.empty_like(x)
+    y_next = np.empty_like(y)
+    x_next[:-1] = x[1:]
+    y_next[:-1] = y[1:]
+    ends = starts + counts - 1
+    x_next[ends] = x[starts]
+    y_next[ends] = y[starts]
+    cross = x * y_next
+    cross -= x_next * y
+    return np.abs(np.add.reduceat(cross, starts)) * 0.5
+
+def bounding_sizes(points, starts):
+    """Cạnh lớn nhất của bounding box từng contour (pixel)"""
+    if len(starts) == 0:
+        return np.empty(0)
+    size = np.maximum.reduceat(points, starts) - np.minimum.reduceat(points, starts)
+    return size.max(axis=1)
+
+def filter_contours(contours, min_area=0, min_size=0):
+    """
+    Bỏ contour có diện tích <= min_area hoặc cạnh bounding box < min_size,
+    tính cho cả tập contour trong một lần
+    """
+    if not contours:
+        return []
+    points, starts, counts = pack_contours(contours)
+    keep = contour_areas(points, starts, counts) > min_area
+    if min_size:
+        keep &= bounding_sizes(points, starts) >= min_size
+    return list(itertools.compress(contours, keep.tolist()))
+
+def _segment_distance(x, y, a, b, index, segment):
+    """
+    Khoảng cách từ điểm index tới đoạn thẳng a-b của đoạn segment (tới điểm
+    đầu mút gần nhất khi hình chiếu nằm ngoài đoạn)
+    """
+    ax, ay = x[a], y[a]
+    dx, dy = x[b] - ax, y[b] - ay
+    length2 = dx * dx + dy * dy
+    ox = x[index] - ax[segment]
+    oy = y[index] - ay[segment]
+    sdx, sdy = dx[segment], dy[segment]
+    distance = np.abs(sdx * oy - sdy * ox)
+    distance *= (1 / np.sqrt(np.where(length2 > 0, length2, 1)))[segment]
+
+    # Hình chiếu nằm ngoài đoạn (hoặc đoạn suy biến): dùng khoảng cách tới đầu mút
+    dot = sdx * ox + sdy * oy
+    before = dot <= 0
+    after = dot >= length2[segment]
+    outside = np.flatnonzero(before | after)
+    if len(outside):
+        ex = np.where(before[outside], ox[outside], ox[outside] - sdx[outside])
+        ey = np.where(before[outside], oy[outside], oy[outside] - sdy[outside])
+        distance[outside] = np.hypot(ex, ey)
+    return distance
+
+def _segment_points(a, b):
+    """Chỉ số các điểm nằm giữa a và b (b - a > 1) của từng đoạn, số thứ tự đoạn và vị trí đầu mỗi đoạn"""
+    lengths = b - a - 1
+    first = np.cumsum(lengths) - lengths
+    segment = np.repeat(np.arange(len(a)), lengths)
+    index = np.arange(int(lengths.sum())) + np.repeat(a + 1 - first, lengths)
+    return index, segment, first
+
+def _farthest(x, y, a, b):
+    """Với mỗi đoạn (a, b): khoảng cách lớn nhất tới đoạn a-b và chỉ số điểm đạt được"""
+    index, segment, first = _segment_points(a, b)
+    distance = _segment_distance(x, y, a, b, index, segment)
+    maximum = np.maximum.reduceat(distance, first)
+    # Điểm đầu tiên đạt giá trị lớn nhất trong mỗi đoạn
+    hits = np.flatnonzero(distance == maximum[segment])
+    position = hits[np.flatnonzero(np.diff(segment[hits], prepend=-1))]
+    return maximum, index[position]
+
+def simplify_dp(points, starts, counts, epsilon):
+    """
+    Douglas–Peucker cho mọi contour khép kín cùng lúc: mỗi vòng lặp chia đôi
+    tất cả các đoạn còn điểm cách đoạn thẳng xấp xỉ hơn epsilon, nên sai số
+    của mọi điểm bị bỏ không vượt quá epsilon
+
+    Returns:
+        ndarray: Mask (N,) các điểm được giữ
+    """
+    epsilon = np.broadcast_to(np.asarray(epsilon, np.float64), counts.shape)
+
+    # Nối thêm điểm đầu vào cuối mỗi contour để thành đường mở
+    ext_starts = starts + np.arange(len(starts))
+    ext_ends = ext_starts + counts
+    source = np.arange(int(counts.sum()) + len(counts)) - np.repeat(np.arange(len(counts)), counts + 1)
+    source[ext_ends] = starts
+    x = points[source, 0].astype(np.float64)
+    y = points[source, 1].astype(np.float64)
+    keep = np.zeros(len(x), bool)
+    keep[ext_starts] = True
+    # Contour ít hơn 3 điểm được giữ nguyên
+    small = counts < 3
+    keep[np.repeat(small, counts + 1)] = True
+
+    # Điểm xa điểm đầu nhất chia contour thành hai đoạn ban đầu
+    large = ~small
+    _, far = _farthest(x, y, ext_starts[large], ext_ends[large])
+    keep[far] = True
+    a = np.concatenate([ext_starts[large], far])
+    b = np.concatenate([far, ext_ends[large]])
+    tolerance = np.concatenate([epsilon[large], epsilon[large]])
+
+    while True:
+        inner = b - a > 1
+        a, b, tolerance = a[inner], b[inner], tolerance[inner]
+        if not len(a):
+            break
+        maximum, middle = _farthest(x, y, a, b)
+        split = maximum > tolerance
+        middle = middle[split]
+        keep[middle] = True
+        a = np.concatenate([a[split], middle])
+        b = np.concatenate([middle, b[split]])
+        tolerance = np.concatenate([tolerance[split], tolerance[split]])
+
+    keep[ext_ends] = False
+    result = np.zeros(len(points), bool)
+    result[source[keep]] = True
+    return result
+
+def simplify_vw(points, starts, counts, epsilon):
+    """
+    Visvalingam–Whyatt theo từng vòng: mỗi vòng bỏ cùng lúc các điểm có tam
+    giác nhỏ nhất so với các điểm kề. Mỗi điểm còn lại mang theo sai số lớn
+    nhất (cận trên) của các điểm đã bỏ giữa nó và điểm sau; một điểm chỉ bị
+    bỏ khi sai số mới vẫn không vượt quá epsilon. Mỗi contour giữ ít nhất 3 điểm
+
+    Returns:
+        ndarray: Mask (N,) các điểm được giữ
+    """
+    x_all = points[:, 0].astype(np.float64)
+    y_all = points[:, 1].astype(np.float64)
+    epsilon = np.repeat(np.broadcast_to(np.asarray(epsilon, np.float64), counts.shape), counts)
+    alive = np.arange(len(points))
+    current = counts.copy()
+    # Sai số của đoạn từ mỗi điểm còn lại tới điểm sau nó
+    span_error = np.zeros(len(points))
+
+    while True:
+        current_starts = np.cumsum(current) - current
+        previous, following = _neighbors(current_starts, current)
+        x, y = x_all[alive], y_all[alive]
+        bx, by = x[previous], y[previous]
+        cx, cy = x[following] - bx, y[following] - by
+        ox, oy = x - bx, y - by
+        cross = np.abs(cx * oy - cy * ox)
+        length2 = cx * cx + cy * cy
+        height = cross / np.sqrt(np.where(length2 > 0, length2, 1))
+        # Khoảng cách tới đoạn (không phải đường thẳng) nối hai điểm kề
+        dot = cx * ox + cy * oy
+        before = dot <= 0
+        after = dot >= length2
+        height = np.where(before, np.hypot(ox, oy), height)
+        height = np.where(after & ~before, np.hypot(ox - cx, oy - cy), height)
+        error = height + np.maximum(span_error[previous], span_error)
+
+        candidate = (error <= epsilon[alive]) & np.repeat(current > 3, current)
+        # Chỉ bỏ cực tiểu địa phương trong các điểm ứng viên; hòa thì xét chẵn/lẻ
+        # để một dãy điểm thẳng hàng giảm một nửa mỗi vòng
+        key = np.where(candidate, cross, np.inf)
+        parity = np.arange(len(alive)) & 1
+        def smaller(other):
+            return (key < key[other]) | ((key == key[other]) & (parity < parity[other]))
+        remove = candidate & smaller(previous) & smaller(following)
+
+        # Không để contour còn ít hơn 3 điểm
+        contour = np.repeat(np.arange(len(current)), current)
+        removed = np.bincount(contour[remove], minlength=len(current))
+        too_many = current - removed < 3
+        remove &= ~too_many[contour]
+        if not remove.any():
+            break
+        span_error[previous[remove]] = error[remove]
+        current = current - np.where(too_many, 0, removed)
+        span_error = span_error[~remove]
+        alive = alive[~remove]
+
+    keep = np.zeros(len(points), bool)
+    keep[alive] = True
+    return keep
+
+SIMPLIFIERS = {'dp': simplify_dp, 'vw': simplify_vw}
+
+def simplify_contours(contours, epsilon, method='dp', min_area=None, min_size=None):
+    """
+    Lọc và đơn giản hóa cả tập contour trên một mảng điểm liền
+
+    Args:
+        contours (list): Contour từ cv2.findContours (hoặc mảng (n, 1, 2) tương tự)
+        epsilon (float): Sai số tối đa (pixel), dùng chung cho mọi contour
+        method (str): 'dp' (Douglas–Peucker, sai số luôn <= epsilon) hoặc
+            'vw' (Visvalingam–Whyatt, bỏ điểm theo diện tích tam giác)
+        min_area (float): Bỏ contour có diện tích <= min_area (pixel vuông), None = không lọc
+        min_size (float): Bỏ contour có cạnh bounding box < min_size (pixel), None = không lọc
+
+    Returns:
+        list: Danh sách mảng điểm (n, 2), giữ nguyên kiểu dữ liệu của contour
+    """
+    if not contours:
+        return []
+    points, starts, counts = pack_contours(contours)
+    keep = np.ones(len(counts), bool)
+    if min_area is not None:
+        keep &= contour_areas(points, starts, counts) > min_area
+    if min_size is not None:
+        keep &= bounding_sizes(points, starts) >= min_size
+    if not keep.all():
+        selected = np.repeat(keep, counts)
+        points = points[selected]
+        counts = counts[keep]
+        starts = np.zeros_like(counts)
+        np.cumsum(counts[:-1], out=starts[1:])
+    if not len(counts):
+        return []
+    mask = SIMPLIFIERS[method](points, starts, counts, epsilon)
+    return unpack_contours(points, mask, starts, counts)